@@ -0,0 +1,175 @@
+# core imports:
+import logging
+import math
+import os
+import signal
+import subprocess
+import sys
+import time
+
+# django framework imports:
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+class Group(object):
+    '''
+    A group of queues served by a local pool of pyres_worker processes.
+
+    Options (all but queues are optional):
+
+    queues                -- list of queues, in priority order;
+    min, max              -- pool size limits (1 and 4 by default);
+    backlog_per_worker    -- jobs in the queues one worker is expected
+                             to handle (100 by default);
+    drain_time            -- if the backlog is shrinking fast enough to
+                             be drained within this number of seconds,
+                             no workers are added (60 by default);
+    scale_up_cooldown,
+    scale_down_cooldown   -- minimum seconds between two changes of the
+                             pool size (30 and 120 by default);
+    args                  -- extra pyres_worker arguments, e.g.
+                             ['--blocking'].
+    '''
+
+    def __init__(self, name, queues, min=1, max=4, backlog_per_worker=100,
+            drain_time=60, scale_up_cooldown=30, scale_down_cooldown=120,
+            args=()):
+        self.name = name
+        self.queues = list(queues)
+        self.min = min
+        self.max = max
+        self.backlog_per_worker = backlog_per_worker
+        self.drain_time = drain_time
+        self.scale_up_cooldown = scale_up_cooldown
+        self.scale_down_cooldown = scale_down_cooldown
+        self.args = list(args)
+
+        self.processes = []
+        # stopped, but maybe still finishing their current job
+        self.stopping = []
+        self.last_change = 0
+        self.last_sample = None  # (time, depth)
+
+    def target(self, depth, now):
+        '''
+        Computes the desired pool size for the given backlog.
+        '''
+        current = len(self.processes)
+        desired = int(math.ceil(depth / float(self.backlog_per_worker)))
+
+        if self.last_sample and desired > current:
+            then, previous = self.last_sample
+            rate = (previous - depth) / max(now - then, 1e-3)
+            if rate > 0 and depth / rate <= self.drain_time:
+                # draining fast enough already
+                desired = current
+        self.last_sample = (now, depth)
+
+        desired = min(max(desired, self.min), self.max)
+        if desired > current and \
+                now - self.last_change < self.scale_up_cooldown:
+            # workers which exited below the minimum are always replaced
+            return max(current, self.min)
+        if desired < current and \
+                now - self.last_change < self.scale_down_cooldown:
+            return current
+        return desired
+
+    def reap(self):
+        alive = []
+        for p in self.processes:
+            if p.poll() is None:
+                alive.append(p)
+            else:
+                logger.warning('%s: worker %d exited with status %d',
+                        self.name, p.pid, p.returncode)
+        self.processes = alive
+        # poll() also collects the exit status of stopped workers
+        self.stopping = [p for p in self.stopping if p.poll() is None]
+
+    def resize(self, size, now):
+        while len(self.processes) < size:
+            self.processes.append(self.spawn())
+            self.last_change = now
+        while len(self.processes) > size:
+            # newest first; SIGQUIT lets the current job finish
+            p = self.processes.pop()
+            logger.info('%s: stopping worker %d', self.name, p.pid)
+            p.send_signal(signal.SIGQUIT)
+            self.stopping.append(p)
+            self.last_change = now
+
+    def spawn(self):
+        env = dict(os.environ, QUEUES=','.join(self.queues))
+        p = subprocess.Popen([sys.executable, os.path.abspath(sys.argv[0]),
+            'pyres_worker'] + self.args, env=env)
+        logger.info('%s: started worker %d', self.name, p.pid)
+        return p
+
+def queue_depths(resq, queues):
+    '''
+    Returns {queue: size} with all LLENs sent in a single pipeline.
+    '''
+    pipe = resq.redis.pipeline(transaction=False)
+    for q in queues:
+        pipe.llen('resque:queue:%s' % q)
+    return dict(zip(queues, [s or 0 for s in pipe.execute()]))
+
+def groups():
+    '''
+    Returns the groups configured in the PYRES_AUTOSCALE settings
+    variable: {group name: {option: value}}, see Group. Raises
+    ValueError if the options of a group are unknown or missing.
+    '''
+    config = getattr(settings, 'PYRES_AUTOSCALE', None) or {}
+    result = []
+    for name, options in sorted(config.items()):
+        try:
+            result.append(Group(name, **options))
+        except TypeError as e:
+            raise ValueError('Invalid settings for group "%s": %s' %
+                    (name, e))
+    return result
+
+class Controller(object):
+    '''
+    Control loop sampling the queue depths every `interval` seconds
+    and resizing the worker pool of every group to its target.
+    '''
+
+    def __init__(self, resq, groups, interval=5, dry_run=False):
+        self.resq = resq
+        self.groups = groups
+        self.interval = interval
+        self.dry_run = dry_run
+        self._shutdown = False
+
+    def run(self):
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            signal.signal(sig, self.shutdown)
+
+        queues = sorted(set(q for g in self.groups for q in g.queues))
+        while not self._shutdown:
+            depths = queue_depths(self.resq, queues)
+            now = time.time()
+            for group in self.groups:
+                group.reap()
+                depth = sum(depths[q] for q in group.queues)
+                size = group.target(depth, now)
+                if size != len(group.processes):
+                    logger.info('%s: backlog %d, workers %d -> %d',
+                            group.name, depth, len(group.processes), size)
+                    if not self.dry_run:
+                        group.resize(size, now)
+            time.sleep(self.interval)
+
+        for group in self.groups:
+            group.resize(0, time.time())
+        for group in self.groups:
+            for p in group.stopping:
+                p.wait()
+            group.stopping = []
+
+    def shutdown(self, signum, frame):
+        self._shutdown = True
@@ -0,0 +1,162 @@
+# core imports:
+import ast
+import imp
+import json
+import logging
+import os
+import time
+
+# django framework imports:
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+# durations of the last discovery steps, in seconds
+timings = {}
+
+def process_uptime():
+    '''
+    Seconds since the current process started, to measure boot time.
+    Only works on Linux, returns None elsewhere.
+    '''
+    try:
+        with open('/proc/self/stat') as f:
+            # fields after the command name, starttime is the 22nd field
+            started = float(f.read().rsplit(')', 1)[1].split()[19])
+        with open('/proc/uptime') as f:
+            uptime = float(f.read().split()[0])
+    except (IOError, OSError, ValueError, IndexError):
+        return None
+    return uptime - started / os.sysconf('SC_CLK_TCK')
+
+def _tasks_file(app):
+    '''
+    Returns the path of the app's tasks.py without importing it,
+    or None if there is no such file.
+    '''
+    # apps are already imported by django at this point
+    try:
+        app_path = __import__(app, {}, {}, [app.split('.')[-1]]).__path__
+    except AttributeError:
+        return None
+    try:
+        found = imp.find_module('tasks', app_path)
+    except ImportError:
+        return None
+    if found[0]:
+        found[0].close()
+    path = found[1]
+    if os.path.isdir(path):
+        path = os.path.join(path, '__init__.py')
+    return path
+
+# bumped whenever _scan() changes, so older index entries are rescanned
+SCAN_VERSION = 2
+
+def _names(body):
+    # names bound at module level: classes, functions, imports and
+    # assignments, including those within if/try/with/for blocks
+    for node in body:
+        if isinstance(node, (ast.ClassDef, ast.FunctionDef)):
+            yield node.name
+            continue
+        if isinstance(node, (ast.Import, ast.ImportFrom)):
+            for alias in node.names:
+                if alias.name == '*':
+                    raise ValueError('star import')
+                yield alias.asname or alias.name.split('.')[0]
+        elif isinstance(node, ast.Assign):
+            for target in node.targets:
+                for name in ast.walk(target):
+                    if isinstance(name, ast.Name):
+                        yield name.id
+        for field in ('body', 'orelse', 'finalbody', 'handlers'):
+            for name in _names(getattr(node, field, None) or []):
+                yield name
+
+def _scan(path):
+    '''
+    Returns the names defined at the top level of a file, parsed
+    without importing it, or None if they can not be told (e.g. the
+    module does a star import).
+    '''
+    with open(path) as f:
+        tree = ast.parse(f.read(), path)
+    try:
+        return sorted(set(_names(tree.body)))
+    except ValueError:
+        return None
+
+def index_file():
+    return getattr(settings, 'PYRES_INDEX_FILE', None)
+
+def build_index(previous=None):
+    '''
+    Maps every app having a tasks module to
+    {'module', 'path', 'mtime', 'version', 'names', 'periodic'}.
+
+    Entries of `previous` whose file has not been modified since
+    are reused as they are; other files are parsed, not imported.
+    Modules whose names are unknown get periodic set to None.
+    '''
+    previous = previous or {}
+    index = {}
+    for app in settings.INSTALLED_APPS:
+        path = _tasks_file(app)
+        if not path or not os.path.exists(path):
+            continue
+        mtime = os.path.getmtime(path)
+        entry = previous.get(app)
+        if not entry or entry['path'] != path or \
+                entry['mtime'] != mtime or \
+                entry.get('version') != SCAN_VERSION:
+            entry = {'module': '%s.tasks' % app, 'path': path,
+                    'mtime': mtime, 'version': SCAN_VERSION, 'names': None,
+                    'periodic': None}
+            # compiled-only modules can not be parsed: periodic is None,
+            # so they are always imported
+            if path.endswith('.py'):
+                entry['names'] = _scan(path)
+            if entry['names'] is not None:
+                entry['periodic'] = [n for n in entry['names'] if
+                        n.startswith('Periodic') or n.startswith('Interval')]
+        index[app] = entry
+    return index
+
+def load_index():
+    '''
+    Returns the discovery index, kept in the PYRES_INDEX_FILE file
+    (if set) and refreshed for modified tasks modules only. An
+    unreadable or corrupt file is rebuilt from scratch.
+    '''
+    started = time.time()
+    path = index_file()
+    previous = None
+    if path and os.path.exists(path):
+        try:
+            with open(path) as f:
+                previous = json.load(f)
+        except (IOError, ValueError):
+            logger.warning('rebuilding unreadable index file %s', path,
+                    exc_info=True)
+        if not isinstance(previous, dict):
+            previous = None
+    index = build_index(previous)
+    if path and index != previous:
+        save_index(index, path)
+    timings['index'] = time.time() - started
+    return index
+
+def save_index(index, path):
+    tmp = '%s.%d' % (path, os.getpid())
+    with open(tmp, 'w') as f:
+        json.dump(index, f)
+    os.rename(tmp, path)
+
+def periodic_modules():
+    '''
+    Returns names of the tasks modules which define periodic jobs:
+    the only ones which have to be imported at startup.
+    '''
+    return [entry['module'] for app, entry in sorted(load_index().items())
+            if entry['periodic'] is None or entry['periodic']]
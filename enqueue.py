@@ -0,0 +1,156 @@
+# core imports:
+import logging
+import threading
+import time
+from functools import wraps
+
+# pyres imports:
+from pyres import ResQ
+
+# django framework imports:
+from django.conf import settings
+from django.db import transaction
+
+# project imports:
+from pyres_django.helpers import get_pyres
+
+logger = logging.getLogger(__name__)
+
+# holds the request-scoped buffer of the current thread
+_local = threading.local()
+
+def payload(klass, args):
+    '''
+    Builds a job payload the same way ResQ.enqueue does.
+    '''
+    return {'class': '%s.%s' % (klass.__module__, klass.__name__),
+            'args': list(args), 'enqueue_timestamp': time.time()}
+
+def enqueue_many(jobs, chunk_size=None, resq=None):
+    '''
+    Enqueues an iterable of (job class, args) pairs.
+
+    Jobs are serialized and sent in pipelined chunks of `chunk_size`
+    (defaults to the PYRES_ENQUEUE_CHUNK_SIZE settings variable or 1000),
+    consuming the iterable lazily, so a generator of any length can be
+    passed without building all payloads in memory. Classes without a
+    queue attribute are skipped, as ResQ.enqueue does.
+
+    Returns the number of enqueued jobs.
+    '''
+    resq = resq or get_pyres()
+    size = chunk_size or getattr(settings, 'PYRES_ENQUEUE_CHUNK_SIZE', 1000)
+    pipe = resq.redis.pipeline(transaction=False)
+    watched = set()
+    pending = 0
+    count = 0
+    for klass, args in jobs:
+        queue = getattr(klass, 'queue', None)
+        if not queue:
+            logger.warning('unable to enqueue job with class %s', klass)
+            continue
+        if queue not in watched:
+            pipe.sadd('resque:queues', queue)
+            watched.add(queue)
+        pipe.rpush('resque:queue:%s' % queue,
+                ResQ.encode(payload(klass, args)))
+        pending += 1
+        if pending >= size:
+            pipe.execute()
+            count += pending
+            pending = 0
+    if pending:
+        pipe.execute()
+        count += pending
+    return count
+
+class EnqueueBuffer(object):
+    '''
+    Collects (job class, args) pairs to enqueue them later
+    with a single enqueue_many() call.
+    '''
+    def __init__(self):
+        self.jobs = []
+
+    def add(self, klass, args):
+        self.jobs.append((klass, args))
+
+    def discard(self):
+        self.jobs = []
+
+    def flush(self):
+        jobs, self.jobs = self.jobs, []
+        if jobs:
+            enqueue_many(jobs)
+
+def _blocks():
+    # buffers of the commit_on_success blocks of the current thread
+    if not hasattr(_local, 'blocks'):
+        _local.blocks = []
+    return _local.blocks
+
+class DeferredTransaction(object):
+    '''
+    django.db.transaction.commit_on_success keeping the jobs passed
+    to defer_enqueue() within the block until the transaction commits.
+    The jobs are dropped if the block raises or the commit fails.
+    '''
+    def __init__(self, using=None):
+        self.using = using
+
+    def __enter__(self):
+        self.transaction = transaction.commit_on_success(using=self.using)
+        self.transaction.__enter__()
+        _blocks().append(EnqueueBuffer())
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        buffer = _blocks().pop()
+        self.transaction.__exit__(exc_type, exc_value, traceback)
+        # django commits on exit of every commit_on_success block,
+        # nested ones included, so the jobs can be sent right away
+        if exc_type is None:
+            buffer.flush()
+
+    def __call__(self, func):
+        @wraps(func)
+        def inner(*args, **kwargs):
+            with DeferredTransaction(self.using):
+                return func(*args, **kwargs)
+        return inner
+
+def commit_on_success(using=None):
+    '''
+    Drop-in replacement of django.db.transaction.commit_on_success
+    (a decorator, with or without arguments, or a context manager)
+    which also defers jobs until commit, see DeferredTransaction.
+    '''
+    if callable(using):
+        return DeferredTransaction()(using)
+    return DeferredTransaction(using)
+
+def defer_enqueue(klass, *args):
+    '''
+    Enqueues a job once it is safe to run it.
+
+    Within a commit_on_success block of this module the job is kept
+    until the block commits and dropped if it fails. Within a request
+    handled by DeferredEnqueueMiddleware jobs are collected until the
+    response is ready and dropped if the view raises. All collected
+    jobs are sent with one pipelined write. Otherwise (transactions
+    managed by other means included) the job is enqueued immediately.
+    '''
+    blocks = _blocks()
+    buffer = blocks and blocks[-1] or getattr(_local, 'buffer', None)
+    if buffer is None:
+        enqueue_many([(klass, args)])
+    else:
+        buffer.add(klass, args)
+
+def begin_request():
+    _local.buffer = EnqueueBuffer()
+
+def end_request(commit=True):
+    buffer = getattr(_local, 'buffer', None)
+    _local.buffer = None
+    if buffer is not None and commit:
+        buffer.flush()
@@ -0,0 +1,273 @@
+# core imports:
+from hashlib import md5
+
+# pyres imports:
+from pyres import ResQ
+
+# redis imports:
+from redis.exceptions import WatchError
+
+# django framework imports:
+from django.conf import settings
+
+FAILED_KEY = 'resque:failed'
+SUMMARY_KEY = 'resque:failed_summary'
+SUMMARY_FIELDS = ('class', 'exception', 'queue')
+
+def chunk_size():
+    '''
+    Number of failed entries handled per pipelined round trip.
+    '''
+    return getattr(settings, 'PYRES_FAILED_CHUNK_SIZE', 1000)
+
+def _decode(item):
+    # the decoded entry, None for corrupt or legacy (non-dict) ones
+    try:
+        failed = ResQ.decode(item)
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(failed, dict):
+        return None
+    return failed
+
+def _field(failed, name):
+    if name == 'class':
+        return failed['payload']['class']
+    if name == 'exception':
+        return failed.get('exception')
+    return failed.get(name)
+
+def matches(failed, filters):
+    '''
+    Checks a decoded failed entry against a dict of filters.
+    Supported filters are "class" (payload class), "queue" and
+    "exception"; an exception filter also matches the exception name
+    the error message starts with.
+    '''
+    for name, value in filters.items():
+        if _field(failed, name) == value:
+            continue
+        if name == 'exception' and \
+                failed.get('error', '').split(':')[0] == value:
+            continue
+        return False
+    return True
+
+def process(resq, action, filters=None, size=None, progress=None):
+    '''
+    Retries or deletes failed jobs matching the given filters
+    (all of them, if no filters are given). `action` is either
+    "retry" or "delete".
+
+    The failed list is streamed in chunks of `size` entries, so memory
+    use does not depend on the list length. Matching entries of each
+    chunk are handled within a single non-transactional pipeline;
+    entries which do not match or can not be decoded are skipped.
+
+    The stored summary is updated with the handled entries of every
+    chunk instead of being rebuilt, see forget().
+
+    `progress`, if given, is called as progress(done, total) after
+    every chunk. Returns the number of handled jobs.
+    '''
+    if action not in ('retry', 'delete'):
+        raise ValueError('Unknown action "%s"' % action)
+    filters = filters or {}
+    size = size or chunk_size()
+    total = resq.redis.llen(FAILED_KEY)
+    raw = _valid_state(resq)
+    scanned = raw and ResQ.decode(raw)['scanned'] or 0
+    seen = 0
+    offset = 0
+    done = 0
+    while True:
+        items = resq.redis.lrange(FAILED_KEY, offset, offset + size - 1)
+        if not items:
+            break
+
+        # handled entries of the part of the list the summary covers
+        forgotten = []
+        pipe = resq.redis.pipeline(transaction=False)
+        for item in items:
+            # index of the entry in the list as it was at the start
+            seen += 1
+            failed = _decode(item)
+            try:
+                matched = failed is not None and matches(failed, filters)
+                queue = failed['queue']
+                payload = failed['payload']
+            except (KeyError, TypeError, AttributeError):
+                matched = False
+            if not matched:
+                # handled entries are removed, skipped ones stay
+                offset += 1
+                continue
+            if action == 'retry':
+                pipe.sadd('resque:queues', queue)
+                pipe.rpush('resque:queue:%s' % queue, ResQ.encode(payload))
+            pipe.lrem(name=FAILED_KEY, num=1, value=item)
+            if seen <= scanned:
+                forgotten.append(failed)
+            done += 1
+        pipe.execute()
+        if forgotten:
+            raw = forget(resq, raw, forgotten)
+
+        if progress:
+            progress(done, total)
+    if raw is None:
+        # out of date: rebuilt by the next summary() call
+        resq.redis.delete(SUMMARY_KEY)
+    return done
+
+def remove(resq, item):
+    '''
+    Removes a single raw entry from the failed list, updating the
+    stored summary. Returns the number of removed entries (0 or 1).
+    '''
+    raw = _valid_state(resq)
+    removed = resq.redis.lrem(name=FAILED_KEY, num=1, value=item)
+    if removed and raw:
+        scanned = ResQ.decode(raw)['scanned']
+        # the last summarized entry did not move: the removed one was
+        # appended after it, so it is not summarized yet
+        tail = scanned and resq.redis.lindex(FAILED_KEY, scanned - 1)
+        if not tail or _digest(tail) != ResQ.decode(raw)['tail']:
+            forget(resq, raw, [_decode(item) or {}])
+    return removed
+
+def retry(resq, item):
+    '''
+    Re-enqueues a job given its raw failed entry and removes the entry.
+    '''
+    failed = ResQ.decode(item)
+    resq.push(failed['queue'], failed['payload'])
+    return remove(resq, item)
+
+def retry_all(resq, size=None, progress=None):
+    '''
+    Re-enqueues every job from the failed list.
+    See process() for details.
+    '''
+    return process(resq, 'retry', None, size, progress)
+
+def _digest(item):
+    return md5(item).hexdigest()
+
+def _count(state, failed, delta):
+    # adds delta to every group the decoded failed entry belongs to;
+    # first/last times are not known any more once entries are removed
+    values = [_field(failed, f) or '' for f in SUMMARY_FIELDS]
+    at = failed.get('failed_at')
+    for f, value in zip(SUMMARY_FIELDS, values):
+        groups = state['groups'][f]
+        group = groups.setdefault(value, {'count': 0, 'first': at,
+            'last': at})
+        group['count'] += delta
+        if group['count'] <= 0:
+            del groups[value]
+            continue
+        if at and (not group['first'] or at < group['first']):
+            group['first'] = at
+        if at and (not group['last'] or at > group['last']):
+            group['last'] = at
+
+def _valid_state(resq):
+    # the raw stored summary, if it matches the failed list
+    raw = resq.redis.get(SUMMARY_KEY)
+    if not raw:
+        return None
+    state = ResQ.decode(raw)
+    if not state['scanned']:
+        return raw
+    tail = resq.redis.lindex(FAILED_KEY, state['scanned'] - 1)
+    if tail and _digest(tail) == state['tail']:
+        return raw
+    return None
+
+def forget(resq, raw, removed):
+    '''
+    Subtracts entries removed from the already summarized part of
+    the failed list from the stored summary, so that summary() does
+    not have to rebuild it. `raw` is the stored summary as read (and
+    checked) before the removal, `removed` the decoded entries.
+
+    If the summary was changed in the meantime, it is dropped
+    and rebuilt by the next summary() call.
+
+    Returns the raw stored summary after the update, None if dropped.
+    '''
+    if not raw:
+        # nothing stored, or already out of date
+        resq.redis.delete(SUMMARY_KEY)
+        return None
+    pipe = resq.redis.pipeline()
+    try:
+        while True:
+            try:
+                pipe.watch(SUMMARY_KEY)
+                if pipe.get(SUMMARY_KEY) != raw:
+                    pipe.multi()
+                    pipe.delete(SUMMARY_KEY)
+                    updated = None
+                else:
+                    state = ResQ.decode(raw)
+                    for failed in removed:
+                        try:
+                            _count(state, failed, -1)
+                        except (KeyError, TypeError, AttributeError):
+                            # not summarized either
+                            pass
+                    state['scanned'] = max(state['scanned'] - len(removed),
+                            0)
+                    tail = state['scanned'] and pipe.lindex(FAILED_KEY,
+                            state['scanned'] - 1)
+                    state['tail'] = tail and _digest(tail) or None
+                    updated = ResQ.encode(state)
+                    pipe.multi()
+                    pipe.set(SUMMARY_KEY, updated)
+                pipe.execute()
+                return updated
+            except WatchError:
+                continue
+    finally:
+        pipe.reset()
+
+def summary(resq, size=None):
+    '''
+    Returns failure counts grouped by payload class, exception and queue,
+    as {field: {value: {'count': n, 'first': time, 'last': time}}}.
+
+    The aggregate is stored in Redis together with the number of scanned
+    entries and a digest of the last one. Only entries appended since
+    the previous call are decoded. Entries retried or deleted with
+    process(), retry() or remove() are subtracted from the aggregate;
+    if the scanned part of the list was changed by other means, the
+    aggregate is rebuilt from scratch.
+    '''
+    size = size or chunk_size()
+    raw = _valid_state(resq)
+    state = raw and ResQ.decode(raw) or None
+    length = resq.redis.llen(FAILED_KEY)
+    if not state:
+        state = {'scanned': 0, 'tail': None,
+                'groups': dict((f, {}) for f in SUMMARY_FIELDS)}
+    if state['scanned'] == length:
+        return state['groups']
+
+    offset = state['scanned']
+    while True:
+        items = resq.redis.lrange(FAILED_KEY, offset, offset + size - 1)
+        if not items:
+            break
+        for item in items:
+            try:
+                _count(state, _decode(item), 1)
+            except (KeyError, TypeError, AttributeError):
+                continue
+        offset += len(items)
+        state['tail'] = _digest(items[-1])
+
+    state['scanned'] = offset
+    resq.redis.set(SUMMARY_KEY, ResQ.encode(state))
+    return state['groups']
@@ -1,8 +1,23 @@
+# core imports:
+import datetime
+import os
+import threading
+import time
+from functools import wraps
+
 # pyres imports:
 from pyres import ResQ
 
+# redis imports:
+from redis import BlockingConnectionPool, ConnectionPool, Redis, \
+        UnixDomainSocketConnection
+
 # django framework imports:
 from django.conf import settings
+from django.core.cache import cache
+
+# project imports:
+from pyres_django import serializers
 
 class WebContainer(object):
     '''
@@ -15,21 +30,300 @@ class WebContainer(object):
         for k, v in kwargs.items():
             setattr(self, k, v)
 
-def redis_size(resq, key):
+def memoized(method):
+    '''
+    Decorator for argument-less view methods.
+    Caches the result on the view instance, so that it is computed
+    at most once per request (django creates a new view instance
+    for every request).
+    '''
+    name = method.__name__
+
+    @wraps(method)
+    def _memoized(self):
+        cache = self.__dict__.setdefault('_memo', {})
+        if name not in cache:
+            cache[name] = method(self)
+        return cache[name]
+
+    return _memoized
+
+class RedisCounter(object):
+    '''
+    Counts commands and round trips sent through a redis client.
+    A pipeline is counted as a single round trip.
+    '''
+    def __init__(self, redis):
+        self.commands = 0
+        self.round_trips = 0
+
+        execute_command = redis.execute_command
+        pipeline = redis.pipeline
+
+        def _execute_command(*args, **options):
+            self.commands += 1
+            self.round_trips += 1
+            return execute_command(*args, **options)
+
+        def _pipeline(*args, **kwargs):
+            pipe = pipeline(*args, **kwargs)
+            execute = pipe.execute
+
+            def _execute(*a, **kw):
+                self.commands += len(pipe.command_stack)
+                self.round_trips += 1
+                return execute(*a, **kw)
+
+            pipe.execute = _execute
+            return pipe
+
+        redis.execute_command = _execute_command
+        redis.pipeline = _pipeline
+
+# commands returning the size of a key, by the key type
+_size_commands = {'list': 'llen', 'set': 'scard', 'zset': 'zcard',
+        'hash': 'hlen'}
+
+def redis_size(resq, key, key_type=None):
     rk = 'resque:'+key
-    key_type = resq.redis.type(rk)
+    if key_type is None:
+        key_type = resq.redis.type(rk)
     item = 0
-    if key_type == 'list':
-        item = resq.redis.llen(rk)
-    elif key_type == 'set':
-        item = resq.redis.scard(rk)
+    if key_type in _size_commands:
+        item = getattr(resq.redis, _size_commands[key_type])(rk)
     elif key_type == 'string':
         item = 1
     return item
 
-def get_pyres():
+def resque_keys(resq):
+    '''
+    Returns the sorted names of all "resque:" keys, without the prefix.
+
+    The keyspace is walked with SCAN, so Redis is never blocked the way
+    KEYS blocks it, and the list is kept in django's cache for
+    PYRES_KEYS_CACHE_TTL seconds (60 by default, 0 disables it), so
+    paging through it does not walk the keyspace again.
+    '''
+    ttl = getattr(settings, 'PYRES_KEYS_CACHE_TTL', 60)
+    key = 'pyres_django:keys:%s:%s' % (resq.host, resq.port)
+    keys = cache.get(key) if ttl else None
+    if keys is None:
+        keys = sorted(k[len('resque:'):] for k in
+                resq.redis.scan_iter(match='resque:*', count=1000))
+        if ttl:
+            cache.set(key, keys, ttl)
+    return keys
+
+def inspect_keys(resq, keys):
+    '''
+    Returns a list of (key, type, size) tuples for the given keys
+    (without the "resque:" prefix).
+
+    Takes exactly two pipelined round trips regardless of the number of
+    keys: one for all TYPEs and one for the size commands of each type.
+    '''
+    if not keys:
+        return []
+
+    pipe = resq.redis.pipeline(transaction=False)
+    for k in keys:
+        pipe.type('resque:'+k)
+    types = pipe.execute()
+
+    pipe = resq.redis.pipeline(transaction=False)
+    for k, t in zip(keys, types):
+        if t in _size_commands:
+            getattr(pipe, _size_commands[t])('resque:'+k)
+    sizes = iter(pipe.execute())
+
+    result = []
+    for k, t in zip(keys, types):
+        if t in _size_commands:
+            size = next(sizes)
+        elif t == 'string':
+            size = 1
+        else:
+            size = 0
+        result.append((k, t, size))
+    return result
+
+def worker_snapshot(resq):
+    '''
+    Fetches all registered workers together with their
+    current job payloads.
+
+    Instead of asking every worker for its state and job separately,
+    payloads of all workers are requested within a single
+    non-transactional pipeline, so the cost does not depend
+    on the number of workers.
+    '''
+    ids = sorted(resq.redis.smembers('resque:workers'))
+    if not ids:
+        return []
+
+    pipe = resq.redis.pipeline(transaction=False)
+    for w in ids:
+        pipe.get('resque:worker:%s' % w)
+    payloads = pipe.execute()
+
+    workers = []
+    for w, payload in zip(ids, payloads):
+        data = payload and ResQ.decode(payload) or {}
+        host, pid, queues = w.split(':')
+        item = {'state': data and 'working' or 'idle',
+                'host': host,
+                'pid': pid,
+                'w': w,
+                'queues': queues.split(','),
+                'queue': data.get('queue')}
+        if 'queue' in data:
+            item['data'] = True
+            item['code'] = data['payload']['class']
+            item['runat'] = datetime.datetime.fromtimestamp(
+                    float(data['run_at']))
+        workers.append(WebContainer(**item))
+    return workers
+
+# in-process cache for queue_sizes: {address: (timestamp, sizes)}
+_queue_sizes_cache = {}
+
+def queue_sizes(resq):
+    '''
+    Returns a sorted list of (queue, size) pairs.
+
+    All LLENs are sent within a single non-transactional pipeline.
+    If the PYRES_QUEUES_CACHE_TTL setting is set to a positive number
+    of seconds, the result is also cached in-process for that time,
+    so concurrently polling dashboards do not multiply the load.
+    '''
+    ttl = getattr(settings, 'PYRES_QUEUES_CACHE_TTL', 0)
+    address = '%s:%s' % (resq.host, resq.port)
+    if ttl > 0:
+        cached = _queue_sizes_cache.get(address)
+        if cached and time.time() - cached[0] < ttl:
+            return cached[1]
+
+    queues = sorted(resq.queues())
+    pipe = resq.redis.pipeline(transaction=False)
+    for q in queues:
+        pipe.llen('resque:queue:%s' % q)
+    sizes = zip(queues, [s or 0 for s in pipe.execute()]) if queues else []
+
+    if ttl > 0:
+        _queue_sizes_cache[address] = (time.time(), sizes)
+    return sizes
+
+def delayed_sizes(resq, timestamps):
+    '''
+    Returns the number of jobs scheduled for each of the given
+    timestamps, with all LLENs sent in a single pipeline.
+    '''
+    if not timestamps:
+        return []
+    pipe = resq.redis.pipeline(transaction=False)
+    for t in timestamps:
+        pipe.llen('resque:delayed:%s' % t)
+    return [s or 0 for s in pipe.execute()]
+
+def delayed_histogram(resq, length, buckets, limit=None):
+    '''
+    Returns ([(bucket start, count)], complete): the number of jobs
+    scheduled for the next `buckets` periods of `length` seconds,
+    preceded by the overdue ones (with None as the start).
+
+    The timestamps of the window are read with a single ZRANGEBYSCORE
+    and their jobs counted with one pipeline of LLENs. At most `limit`
+    timestamps (the PYRES_DELAYED_HISTOGRAM_LIMIT settings variable,
+    10000 by default) are counted, the earliest first; complete is
+    False if the window has more of them.
+    '''
+    limit = limit or getattr(settings, 'PYRES_DELAYED_HISTOGRAM_LIMIT',
+            10000)
+    now = int(time.time())
+    first = now - now % length
+    starts = [first + i * length for i in range(buckets)]
+    timestamps = resq.redis.zrangebyscore('resque:delayed_queue_schedule',
+            '-inf', '(%d' % (first + buckets * length), start=0,
+            num=limit + 1)
+    complete = len(timestamps) <= limit
+    timestamps = [int(t) for t in timestamps[:limit]]
+
+    counts = [0] * (buckets + 1)
+    for t, size in zip(timestamps, delayed_sizes(resq, timestamps)):
+        # index 0 holds the overdue jobs
+        counts[0 if t < now else (t - first) // length + 1] += size
+    return zip([None] + starts, counts), complete
+
+def close_db_connections():
+    '''
+    Closes django database connections of the current thread.
+    Used before forking and after jobs run in worker threads.
+    '''
+    from django.db import connections
+    for connection in connections.all():
+        connection.close()
+
+# process-wide connection pool, recreated after fork: (pid, pool)
+_pool = (None, None)
+_pool_lock = threading.Lock()
+
+def _redis_address():
+    socket = getattr(settings, 'REDIS_UNIX_SOCKET', None)
+    if socket:
+        return socket, 0
+    return (getattr(settings, 'REDIS_HOST', 'localhost'),
+            getattr(settings, 'REDIS_PORT', 6379))
+
+def connection_pool():
+    '''
+    Returns the redis connection pool of the current process.
+
+    Configured with the REDIS_HOST, REDIS_PORT (or REDIS_UNIX_SOCKET),
+    REDIS_DB, REDIS_PASSWORD, PYRES_SOCKET_TIMEOUT and
+    PYRES_SOCKET_CONNECT_TIMEOUT settings variables.
+
+    If PYRES_MAX_CONNECTIONS is set, the pool holds at most that many
+    connections and a thread finding all of them in use waits up to
+    PYRES_POOL_TIMEOUT seconds (20 by default) for one to be released
+    instead of failing at once.
+    '''
+    global _pool
+    pid = os.getpid()
+    if _pool[0] != pid:
+        with _pool_lock:
+            if _pool[0] != pid:
+                # a forked child must not reuse the parent's sockets
+                kwargs = {'db': getattr(settings, 'REDIS_DB', 0),
+                    'password': getattr(settings, 'REDIS_PASSWORD', None),
+                    'socket_timeout': getattr(settings,
+                        'PYRES_SOCKET_TIMEOUT', None),
+                    'socket_connect_timeout': getattr(settings,
+                        'PYRES_SOCKET_CONNECT_TIMEOUT', None)}
+                host, port = _redis_address()
+                if port:
+                    kwargs.update(host=host, port=port)
+                else:
+                    kwargs.update(path=host,
+                            connection_class=UnixDomainSocketConnection)
+                limit = getattr(settings, 'PYRES_MAX_CONNECTIONS', None)
+                if limit:
+                    pool = BlockingConnectionPool(max_connections=limit,
+                            timeout=getattr(settings, 'PYRES_POOL_TIMEOUT',
+                                20), **kwargs)
+                else:
+                    pool = ConnectionPool(**kwargs)
+                _pool = (pid, pool)
+    return _pool[1]
+
+def get_pyres(resq_class=ResQ):
     '''
     Connection getter.
+    Returned ResQ objects are cheap: all of them share the
+    connection pool of the current process.
     '''
-    return ResQ('%s:%d' % (getattr(settings, 'REDIS_HOST', 'localhost'),
-        getattr(settings, 'REDIS_PORT', 6379)))
+    serializers.install()
+    redis = Redis(connection_pool=connection_pool())
+    # ResQ takes the address from these instead of
+    # checking a connection out of the pool
+    redis.host, redis.port = _redis_address()
+    return resq_class(redis)
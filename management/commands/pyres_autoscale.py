@@ -0,0 +1,47 @@
+# core imports:
+from optparse import make_option
+
+# django framework imports:
+from django.core.management.base import CommandError, NoArgsCommand
+
+# project imports:
+from pyres_django.helpers import get_pyres
+from pyres_django.autoscale import Controller, groups
+
+class Command(NoArgsCommand):
+    help = ('Runs pools of pyres_worker processes sized after the depth '
+            'of their queues, as configured in the PYRES_AUTOSCALE '
+            'settings variable.')
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('-i', '--interval', action='store', dest='interval',
+            default=5, help='Queue sampling interval. Defaults to 5 '
+            'seconds.'),
+
+        make_option('-n', '--dry-run', action='store_true',
+            dest='dry_run', default=False, help='Only log the pool size '
+            'changes, do not start or stop any worker.'),
+        )
+
+    def handle_noargs(self, **options):
+        try:
+            configured = groups()
+        except ValueError as e:
+            raise CommandError(str(e))
+        if not configured:
+            raise CommandError('No worker groups to scale. Try set the '
+                    'PYRES_AUTOSCALE django settings variable, e.g.\n'
+                    "PYRES_AUTOSCALE = {'default': {'queues': ['q1'], "
+                    "'max': 8}}")
+        for group in configured:
+            if not group.queues or group.min > group.max:
+                raise CommandError('Invalid settings for group "%s"' %
+                        group.name)
+
+        try:
+            interval = float(options.get('interval'))
+        except ValueError:
+            raise CommandError('Interval must be a number')
+
+        Controller(get_pyres(), configured, interval,
+                options.get('dry_run')).run()
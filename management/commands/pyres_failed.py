@@ -0,0 +1,68 @@
+# core imports:
+from optparse import make_option
+
+# django framework imports:
+from django.core.management.base import BaseCommand, CommandError
+
+# project imports:
+from pyres_django.helpers import get_pyres
+from pyres_django.failures import process, summary, SUMMARY_FIELDS
+
+class Command(BaseCommand):
+    args = '<action>'
+    help = ('Bulk operations on the failed jobs list. '
+            'Available actions: "retry", "delete", "summary". Jobs can '
+            'be filtered by payload class, queue and exception.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('-c', '--chunk-size', action='store',
+            dest='chunk_size', default=None, help='Number of failed '
+            'jobs handled per Redis round trip. Defaults to the '
+            'PYRES_FAILED_CHUNK_SIZE settings variable or 1000.'),
+
+        make_option('--class', action='store', dest='class',
+            help='Only handle failed jobs of the given payload class.'),
+
+        make_option('--queue', action='store', dest='queue',
+            help='Only handle failed jobs of the given queue.'),
+
+        make_option('--exception', action='store', dest='exception',
+            help='Only handle failed jobs with the given exception.'),
+        )
+
+    def handle(self, *args, **options):
+        if len(args) != 1:
+            raise CommandError('Exactly one action should be specified, '
+                    'e.g.\n$ python2 manage.py pyres_failed retry')
+        action = args[0]
+
+        size = options.get('chunk_size')
+        if size is not None:
+            try:
+                size = int(size)
+            except ValueError:
+                raise CommandError('Chunk size must be an integer')
+
+        filters = dict((name, options[name]) for name in
+                ('class', 'queue', 'exception') if options.get(name))
+
+        if action in ('retry', 'delete'):
+            done = process(get_pyres(), action, filters, size,
+                    self._progress(action))
+            self.stdout.write('%s: %d failed jobs\n' % (action, done))
+        elif action == 'summary':
+            groups = summary(get_pyres(), size)
+            for field in SUMMARY_FIELDS:
+                self.stdout.write('By %s:\n' % field)
+                for value, group in sorted(groups[field].items(),
+                        key=lambda i: -i[1]['count']):
+                    self.stdout.write('  %8d  %s  (%s - %s)\n' % (
+                        group['count'], value, group['first'],
+                        group['last']))
+        else:
+            raise CommandError('Unknown action "%s"' % action)
+
+    def _progress(self, verb):
+        def _report(done, total):
+            self.stdout.write('%s: %d of %d\n' % (verb, done, total))
+        return _report
@@ -0,0 +1,21 @@
+# django framework imports:
+from django.core.management.base import CommandError, NoArgsCommand
+
+# project imports:
+from pyres_django.discovery import build_index, index_file, save_index
+
+class Command(NoArgsCommand):
+    help = ('Builds the index of tasks modules used by '
+            'pyres_django.autodiscover() and saves it to the file set by '
+            'the PYRES_INDEX_FILE settings variable.')
+
+    def handle_noargs(self, **options):
+        path = index_file()
+        if not path:
+            raise CommandError('Set the PYRES_INDEX_FILE settings variable '
+                    'to the path of the index file.')
+        index = build_index()
+        save_index(index, path)
+        for app, entry in sorted(index.items()):
+            self.stdout.write('%s: %s\n' % (entry['module'],
+                ', '.join(entry['periodic'] or []) or '-'))
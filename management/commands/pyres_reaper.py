@@ -0,0 +1,50 @@
+# core imports:
+import time
+from optparse import make_option
+
+# django framework imports:
+from django.core.management.base import CommandError, NoArgsCommand
+
+# project imports:
+from pyres_django.helpers import get_pyres
+from pyres_django.reaper import reap
+
+class Command(NoArgsCommand):
+    help = ('Unregisters workers which stopped sending heartbeats and '
+            'fails (or requeues) the jobs they were running.')
+
+    option_list = NoArgsCommand.option_list + (
+        make_option('--requeue', action='store_true', dest='requeue',
+            default=False, help='Push the jobs of dead workers back to '
+            'their queues instead of failing them.'),
+
+        make_option('--unmonitored', action='store_true',
+            dest='unmonitored', default=False, help='Also reap workers '
+            'which never sent a heartbeat, e.g. left over from before '
+            'heartbeats were enabled. Workers not started by '
+            'pyres_worker are reaped as well!'),
+
+        make_option('-i', '--interval', action='store', dest='interval',
+            help='Keep running and reap every given number of seconds. '
+            'Reaps once if not specified.'),
+        )
+
+    def handle_noargs(self, **options):
+        interval = options.get('interval')
+        if interval is not None:
+            try:
+                interval = float(interval)
+            except ValueError:
+                raise CommandError('Interval must be a number')
+
+        resq = get_pyres()
+        while True:
+            ids, jobs = reap(resq, options.get('requeue'),
+                    options.get('unmonitored'))
+            if ids:
+                self.stdout.write('Reaped %d dead workers, %d jobs %s.\n' %
+                        (len(ids), jobs, options.get('requeue') and
+                            'requeued' or 'failed'))
+            if interval is None:
+                break
+            time.sleep(interval)
@@ -0,0 +1,74 @@
+# core imports:
+from optparse import make_option
+
+# django framework imports:
+from django.core.management.base import BaseCommand, CommandError
+
+# project imports:
+from pyres_django.helpers import get_pyres
+from pyres_django.search import search
+
+class Command(BaseCommand):
+    help = ('Searches jobs by a part of their class name and/or arguments '
+            'in the given queues, the delayed jobs and the failed list.')
+
+    option_list = BaseCommand.option_list + (
+        make_option('--class', action='store', dest='class',
+            help='Part of the job class name.'),
+
+        make_option('--args', action='store', dest='args',
+            help='Part of the JSON-encoded job arguments.'),
+
+        make_option('-q', '--queue', action='append', dest='queues',
+            default=[], help='Queue to search in. May be given several '
+            'times.'),
+
+        make_option('--all-queues', action='store_true',
+            dest='all_queues', default=False,
+            help='Search in all queues.'),
+
+        make_option('--delayed', action='store_true', dest='delayed',
+            default=False, help='Search in the delayed jobs.'),
+
+        make_option('--failed', action='store_true', dest='failed',
+            default=False, help='Search in the failed jobs.'),
+
+        make_option('-l', '--limit', action='store', dest='limit',
+            default=100, help='Maximum number of results. Defaults to 100.'),
+
+        make_option('-b', '--budget', action='store', dest='budget',
+            default=10, help='Maximum search time in seconds. Defaults '
+            'to 10.'),
+        )
+
+    def handle(self, *args, **options):
+        if not (options.get('class') or options.get('args')):
+            raise CommandError('Specify --class and/or --args to search for')
+
+        try:
+            limit = int(options.get('limit'))
+            budget = float(options.get('budget'))
+        except ValueError:
+            raise CommandError('Limit and budget must be numbers')
+
+        resq = get_pyres()
+        queues = options.get('queues')
+        if options.get('all_queues'):
+            queues = sorted(resq.queues())
+        sources = ['queue:%s' % q for q in queues]
+        if options.get('delayed'):
+            sources.append('delayed')
+        if options.get('failed'):
+            sources.append('failed')
+        if not sources:
+            raise CommandError('Specify where to search: --queue, '
+                    '--all-queues, --delayed and/or --failed')
+
+        results, complete = search(resq, sources, options.get('class'),
+                options.get('args'), limit, budget)
+        for r in results:
+            self.stdout.write('%s %s #%d  %s  %s\n' % (r['source'],
+                r['location'], r['index'], r['cls'], r['args']))
+        if not complete:
+            self.stdout.write('The search was stopped after %d results '
+                    'or %s seconds.\n' % (limit, budget))
@@ -11,6 +11,18 @@ from django.core.management.base import CommandError, NoArgsCommand
 from pyres import setup_logging
 from pyres.worker import Worker
 
+# project imports:
+from pyres_django.helpers import get_pyres
+from pyres_django.prefork import Master
+from pyres_django import metrics
+from pyres_django.discovery import process_uptime
+from pyres_django.reaper import Reaper
+from pyres_django.worker import (BlockingWorker, BatchWorker,
+        ThreadedWorker, WorkerSlot, MetricsMixin, HeartbeatMixin,
+        CachedJob)
+
+logger = logging.getLogger('pyres')
+
 class Command(NoArgsCommand):
     help = ('Runs pyres worker for queues specified in the PYRES_QUEUES '
             'settings variable or, if not present, specified in the '
@@ -21,6 +33,34 @@ class Command(NoArgsCommand):
             default=5, help='Worker polling interval. Defaults to 5 '
             'seconds'),
 
+        make_option('-b', '--blocking', action='store_true',
+            dest='blocking', default=False, help='Wait for jobs with a '
+            'blocking pop over all queues instead of polling them. '
+            'The interval is then used as the blocking timeout.'),
+
+        make_option('-k', '--batch-size', action='store',
+            dest='batch_size', default=1, help='Fetch up to this number '
+            'of jobs per round trip and run them one after another in '
+            'a single child process. Implies --blocking. Defaults to 1 '
+            '(no batching).'),
+
+        make_option('-t', '--threads', action='store', dest='threads',
+            default=1, help='Run up to this number of jobs at once in '
+            'a thread pool instead of forking for every job. Suitable '
+            'for I/O-bound jobs. Defaults to 1 (no threads).'),
+
+        make_option('-m', '--metrics', action='store_true',
+            dest='metrics', default=False, help='Record per-queue and '
+            'per-class throughput, runtime and wait time metrics, shown '
+            'on the Stats page. Also enabled by the PYRES_METRICS '
+            'settings variable.'),
+
+        make_option('-r', '--reaper', action='store_true',
+            dest='reaper', default=False, help='Also run a thread '
+            'unregistering dead workers and failing their jobs, see '
+            'the pyres_reaper command. Also enabled by the PYRES_REAPER '
+            'settings variable.'),
+
         make_option('-l', '--log-level', action='store',
             dest='log_level', default='info', help='Worker log level. Valid '
             'values are: "debug", "info", "warning", "error", '
@@ -29,6 +69,11 @@ class Command(NoArgsCommand):
 
         make_option('-f', '--file', dest='log_file', help='If present, '
             'a log file will be used.'),
+
+        make_option('-c', '--concurrency', action='store',
+            dest='concurrency', default=1, help='Number of worker '
+            'processes to fork from a single master process. Defaults '
+            'to 1 (no master process).'),
         )
 
     def handle_noargs(self, **options):
@@ -44,17 +89,68 @@ class Command(NoArgsCommand):
         if isinstance(queues, basestring):
             queues = queues.split(',')
 
-        server = "%s:%d" % (getattr(settings, 'REDIS_HOST',
-            'localhost'), getattr(settings, 'REDIS_PORT', 6379))
-
         try:
             interval = int(options.get('interval'))
         except ValueError:
             raise CommandError('Interval must be an integer')
 
+        try:
+            concurrency = int(options.get('concurrency'))
+        except ValueError:
+            raise CommandError('Concurrency must be an integer')
+        if concurrency < 1:
+            raise CommandError('Concurrency must be a positive integer')
+
+        try:
+            batch_size = int(options.get('batch_size'))
+        except ValueError:
+            raise CommandError('Batch size must be an integer')
+        if batch_size < 1:
+            raise CommandError('Batch size must be a positive integer')
+
+        try:
+            threads = int(options.get('threads'))
+        except ValueError:
+            raise CommandError('Threads must be an integer')
+        if threads < 1:
+            raise CommandError('Threads must be a positive integer')
+        if threads > 1 and batch_size > 1:
+            raise CommandError('--threads and --batch-size can not be '
+                    'used together')
+
         log_level = getattr(logging, options.get('log_level').upper(),
                 'INFO')
         setup_logging("pyres", log_level=log_level,
                 filename=options.get('log_file'))
 
-        Worker.run(queues, server, interval)
+        record = options.get('metrics') or metrics.enabled()
+        bases = (HeartbeatMixin,) + (record and (MetricsMixin,) or ())
+
+        worker_class = Worker
+        if options.get('blocking'):
+            worker_class = BlockingWorker
+        if batch_size > 1:
+            worker_class = type('BatchWorker', bases + (BatchWorker,),
+                    {'batch_size': batch_size})
+        elif threads > 1:
+            worker_class = type('ThreadedWorker', (ThreadedWorker,),
+                    {'threads': threads, 'slot_class': type('WorkerSlot',
+                        bases + (WorkerSlot,), {})})
+        else:
+            worker_class = type(worker_class.__name__,
+                    bases + (worker_class,), {'job_class': CachedJob})
+
+        logger.info('worker ready %s seconds after process start',
+                process_uptime())
+
+        if options.get('reaper') or getattr(settings, 'PYRES_REAPER', False):
+            Reaper(get_pyres()).start()
+
+        # get_pyres() is called in the worker process itself,
+        # so every forked worker gets its own connection pool
+        run = lambda: worker_class.run(queues, get_pyres(),
+                interval=interval)
+        if concurrency == 1:
+            run()
+        else:
+            Master(concurrency, run).run()
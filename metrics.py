@@ -0,0 +1,122 @@
+# core imports:
+import time
+
+# django framework imports:
+from django.conf import settings
+
+# (name, bucket length, retention) in seconds
+RESOLUTIONS = (('1m', 60, 2 * 24 * 3600),
+        ('1h', 3600, 30 * 24 * 3600))
+
+# upper bounds of the runtime histogram bins, in milliseconds
+BINS = (1, 2, 5, 10, 20, 50, 100, 200, 500, 1000, 2000, 5000, 10000,
+        30000, 60000, 300000)
+
+def enabled():
+    return getattr(settings, 'PYRES_METRICS', False)
+
+def _key(resolution, bucket):
+    return 'resque:metrics:%s:%d' % (resolution, bucket)
+
+def _bin(ms):
+    for upper in BINS:
+        if ms <= upper:
+            return upper
+    return 0  # overflow bin
+
+def record(resq, samples):
+    '''
+    Records finished jobs into time-bucketed hashes.
+
+    `samples` is a list of (queue, class, runtime, wait, failed) tuples,
+    runtime and wait (time spent in the queue, None if unknown) in
+    seconds. Every resolution gets its own bucket, so no separate
+    roll-up is needed; buckets expire after their retention time.
+    All samples are written within a single pipeline.
+    '''
+    if not samples:
+        return
+    now = int(time.time())
+    pipe = resq.redis.pipeline(transaction=False)
+    for resolution, length, retention in RESOLUTIONS:
+        key = _key(resolution, now - now % length)
+        for queue, cls, runtime, wait, failed in samples:
+            ms = int(runtime * 1000)
+            pipe.hincrby(key, 'processed:%s' % queue, 1)
+            if failed:
+                pipe.hincrby(key, 'failed:%s' % queue, 1)
+            pipe.hincrby(key, 'jobs:%s' % cls, 1)
+            pipe.hincrby(key, 'runtime:%s' % cls, ms)
+            pipe.hincrby(key, 'hist:%s:%d' % (cls, _bin(ms)), 1)
+            if wait is not None:
+                pipe.hincrby(key, 'waited:%s' % cls, 1)
+                pipe.hincrby(key, 'wait:%s' % cls, int(wait * 1000))
+        pipe.expire(key, retention)
+    pipe.execute()
+
+def _percentile(hist, count, p):
+    seen = 0
+    for upper in sorted(hist, key=lambda u: u or float('inf')):
+        seen += hist[upper]
+        if seen >= count * p:
+            return upper or None  # None: above the largest bin
+    return None
+
+def report(resq, resolution='1m', buckets=60):
+    '''
+    Reads the last `buckets` buckets of the given resolution with
+    a single pipeline and returns (series, queues, classes):
+
+    series  -- [(bucket start, processed, failed)], oldest first;
+    queues  -- {queue: {'processed', 'failed', 'rate'}};
+    classes -- {class: {'jobs', 'rate', 'avg', 'p50', 'p95', 'p99',
+               'wait'}}, times in milliseconds, rates in jobs per second.
+    '''
+    length = dict((r[0], r[1]) for r in RESOLUTIONS)[resolution]
+    now = int(time.time())
+    starts = [now - now % length - i * length
+            for i in reversed(range(buckets))]
+    pipe = resq.redis.pipeline(transaction=False)
+    for start in starts:
+        pipe.hgetall(_key(resolution, start))
+
+    series = []
+    queues = {}
+    classes = {}
+    for start, data in zip(starts, pipe.execute()):
+        processed = failed = 0
+        for field, value in data.items():
+            kind, name = field.split(':', 1)
+            value = int(value)
+            if kind in ('processed', 'failed'):
+                queue = queues.setdefault(name, {'processed': 0,
+                    'failed': 0})
+                queue[kind] += value
+                if kind == 'processed':
+                    processed += value
+                else:
+                    failed += value
+                continue
+            if kind == 'hist':
+                name, upper = name.rsplit(':', 1)
+            cls = classes.setdefault(name, {'jobs': 0, 'runtime': 0,
+                'waited': 0, 'wait': 0, 'hist': {}})
+            if kind == 'hist':
+                upper = int(upper)
+                cls['hist'][upper] = cls['hist'].get(upper, 0) + value
+            else:
+                cls[kind] += value
+        series.append((start, processed, failed))
+
+    period = float(length * buckets)
+    for queue in queues.values():
+        queue['rate'] = queue['processed'] / period
+    for cls in classes.values():
+        hist = cls.pop('hist')
+        count = cls['jobs']
+        cls['rate'] = count / period
+        cls['avg'] = count and cls['runtime'] / count
+        cls['wait'] = cls['waited'] and cls['wait'] / cls['waited'] or None
+        for p in (50, 95, 99):
+            cls['p%d' % p] = _percentile(hist, count, p / 100.0)
+    return series, queues, classes
@@ -0,0 +1,23 @@
+# project imports:
+from pyres_django.enqueue import begin_request, end_request
+
+class DeferredEnqueueMiddleware(object):
+    '''
+    Collects jobs passed to defer_enqueue() during a request and
+    enqueues them with a single pipelined write when the response
+    is ready. Jobs are dropped if the view raises.
+
+    Put it above django.middleware.transaction.TransactionMiddleware,
+    so that the jobs are sent after the request transaction commits
+    and dropped when it is rolled back.
+    '''
+    def process_request(self, request):
+        begin_request()
+
+    def process_exception(self, request, exception):
+        end_request(commit=False)
+
+    def process_response(self, request, response):
+        # TransactionMiddleware commits whatever the status code is
+        end_request()
+        return response
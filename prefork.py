@@ -0,0 +1,85 @@
+# core imports:
+import errno
+import logging
+import os
+import signal
+import time
+
+# project imports:
+from pyres_django.helpers import close_db_connections
+
+logger = logging.getLogger(__name__)
+
+class Master(object):
+    '''
+    Prefork process manager.
+
+    Forks `concurrency` children, each of them calling `target`.
+    Everything imported before run() (django, project code) is shared
+    between the children through copy-on-write. Crashed children are
+    restarted; SIGTERM, SIGINT and SIGQUIT are forwarded to all children,
+    after which the master waits for them to exit.
+    '''
+
+    # do not restart a child more often than this (seconds)
+    restart_delay = 1
+
+    def __init__(self, concurrency, target):
+        self.concurrency = concurrency
+        self.target = target
+        self.children = {}
+        self._shutdown = False
+
+    def run(self):
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGQUIT):
+            signal.signal(sig, self._forward)
+
+        for i in range(self.concurrency):
+            self.spawn()
+
+        while self.children:
+            try:
+                pid, status = os.wait()
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                if e.errno == errno.ECHILD:
+                    break
+                raise
+
+            started = self.children.pop(pid, None)
+            if started is None or self._shutdown:
+                continue
+
+            logger.warning('worker %d exited with status %d, restarting',
+                    pid, status)
+            if time.time() - started < self.restart_delay:
+                time.sleep(self.restart_delay)
+            self.spawn()
+
+    def spawn(self):
+        # children must not share the master's database sockets
+        close_db_connections()
+        pid = os.fork()
+        if pid:
+            self.children[pid] = time.time()
+            logger.info('forked worker %d', pid)
+            return pid
+
+        # child process
+        for sig in (signal.SIGTERM, signal.SIGINT, signal.SIGQUIT):
+            signal.signal(sig, signal.SIG_DFL)
+        try:
+            self.target()
+        except Exception:
+            logger.exception('worker %d crashed', os.getpid())
+            os._exit(1)
+        os._exit(0)
+
+    def _forward(self, signum, frame):
+        self._shutdown = True
+        for pid in self.children.keys():
+            try:
+                os.kill(pid, signum)
+            except OSError:
+                pass
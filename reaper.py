@@ -0,0 +1,219 @@
+# core imports:
+import datetime
+import logging
+import os
+import threading
+import time
+
+# pyres imports:
+from pyres import ResQ
+
+# django framework imports:
+from django.conf import settings
+
+logger = logging.getLogger(__name__)
+
+WORKERS_KEY = 'resque:workers'
+# ids of the workers sending heartbeats
+MONITORED_KEY = 'resque:workers:heartbeat'
+
+def heartbeat_key(worker_id):
+    return 'resque:worker:%s:heartbeat' % worker_id
+
+def heartbeat_ttl():
+    return getattr(settings, 'PYRES_HEARTBEAT_TTL', 60)
+
+class Heartbeat(threading.Thread):
+    '''
+    Daemon thread refreshing the heartbeat keys of all workers of
+    the process every third of the TTL (the PYRES_HEARTBEAT_TTL
+    settings variable, 60 seconds by default), in a single pipeline.
+    '''
+
+    def __init__(self, resq):
+        super(Heartbeat, self).__init__(name='pyres-heartbeat')
+        self.daemon = True
+        self.resq = resq
+        self.ids = set()
+        self._lock = threading.Lock()
+
+    def add(self, worker_id):
+        with self._lock:
+            if worker_id in self.ids:
+                return
+            self.ids.add(worker_id)
+        self.beat([worker_id])
+
+    def remove(self, worker_id):
+        with self._lock:
+            self.ids.discard(worker_id)
+        pipe = self.resq.redis.pipeline(transaction=False)
+        pipe.srem(MONITORED_KEY, worker_id)
+        pipe.delete(heartbeat_key(worker_id))
+        pipe.execute()
+
+    def beat(self, ids=None):
+        if ids is None:
+            with self._lock:
+                ids = list(self.ids)
+        if not ids:
+            return
+        ttl = heartbeat_ttl()
+        pipe = self.resq.redis.pipeline(transaction=False)
+        for worker_id in ids:
+            pipe.set(heartbeat_key(worker_id), int(time.time()), ex=ttl)
+        pipe.sadd(MONITORED_KEY, *ids)
+        pipe.execute()
+
+    def run(self):
+        while True:
+            time.sleep(max(heartbeat_ttl() / 3.0, 1))
+            try:
+                self.beat()
+            except Exception:
+                # keep beating once the connection is back
+                logger.exception('heartbeat failed')
+
+# heartbeat thread of the current process: (pid, Heartbeat)
+_heartbeat = None
+_heartbeat_lock = threading.Lock()
+
+def heartbeat(resq):
+    '''
+    Returns the heartbeat thread of the current process, started on
+    first use. A forked child gets a thread of its own.
+    '''
+    global _heartbeat
+    with _heartbeat_lock:
+        if _heartbeat is None or _heartbeat[0] != os.getpid():
+            thread = Heartbeat(resq)
+            thread.start()
+            _heartbeat = (os.getpid(), thread)
+        return _heartbeat[1]
+
+def after_fork():
+    '''
+    Called in children forked to run jobs. Only the forking thread
+    survives fork, so the heartbeat thread is gone and its lock may
+    have been held when forking: both are dropped, without starting
+    a thread, as children never send heartbeats.
+    '''
+    global _heartbeat, _heartbeat_lock
+    _heartbeat = None
+    _heartbeat_lock = threading.Lock()
+
+def dead_workers(resq, unmonitored=False):
+    '''
+    Returns ids of the workers whose heartbeat has expired.
+
+    Workers which never sent a heartbeat (e.g. not started by
+    pyres_worker) are only considered dead if `unmonitored` is set.
+    '''
+    ids = resq.redis.smembers(MONITORED_KEY)
+    if unmonitored:
+        ids = ids | resq.redis.smembers(WORKERS_KEY)
+    ids = sorted(ids)
+    pipe = resq.redis.pipeline(transaction=False)
+    for worker_id in ids:
+        pipe.exists(heartbeat_key(worker_id))
+    return [i for i, alive in zip(ids, pipe.execute()) if not alive]
+
+def _failed_entry(worker_id, queue, payload):
+    # same format as the failures saved by pyres
+    return ResQ.encode({
+        'failed_at': datetime.datetime.now().strftime('%Y/%m/%d %H:%M:%S'),
+        'payload': payload,
+        'exception': 'CrashError',
+        'error': 'Worker %s stopped sending heartbeats' % worker_id,
+        'backtrace': [],
+        'queue': queue,
+        'worker': worker_id,
+    })
+
+def reap(resq, requeue=False, unmonitored=False):
+    '''
+    Unregisters the dead workers (see dead_workers()) and deletes
+    their keys, a few pipelined round trips for all of them.
+
+    Jobs they were running, including the unfinished jobs of
+    BatchWorker batches, are failed or, if `requeue` is set, pushed
+    back to the head of their queues. Every dead worker is claimed by
+    removing it from the worker sets, so concurrent reapers never
+    handle a job twice.
+
+    Returns (reaped worker ids, number of jobs requeued or failed).
+    '''
+    ids = dead_workers(resq, unmonitored)
+    if not ids:
+        return [], 0
+
+    pipe = resq.redis.pipeline(transaction=False)
+    for worker_id in ids:
+        pipe.srem(WORKERS_KEY, worker_id)
+        pipe.srem(MONITORED_KEY, worker_id)
+    removed = pipe.execute()
+    ids = [i for n, i in enumerate(ids) if removed[2 * n] or
+            removed[2 * n + 1]]
+
+    pipe = resq.redis.pipeline(transaction=False)
+    for worker_id in ids:
+        pipe.get('resque:worker:%s' % worker_id)
+        pipe.get('resque:worker:%s:batch_queue' % worker_id)
+        pipe.lrange('resque:worker:%s:batch' % worker_id, 0, -1)
+    found = pipe.execute()
+
+    jobs = 0
+    pipe = resq.redis.pipeline(transaction=False)
+    for n, worker_id in enumerate(ids):
+        current, batch_queue, batch = found[3 * n:3 * n + 3]
+        # a batch only holds the jobs not finished yet, its first one
+        # is the job the worker key points to, if not finished either
+        if batch_queue:
+            inflight = [{'queue': batch_queue, 'payload': ResQ.decode(i)}
+                    for i in batch]
+        elif current:
+            inflight = [ResQ.decode(current)]
+        else:
+            inflight = []
+        if requeue:
+            for job in reversed(inflight):
+                pipe.lpush('resque:queue:%s' % job['queue'],
+                        ResQ.encode(job['payload']))
+        elif inflight:
+            pipe.rpush('resque:failed', *[_failed_entry(worker_id,
+                job['queue'], job['payload']) for job in inflight])
+            pipe.incr('resque:stat:failed', len(inflight))
+        jobs += len(inflight)
+
+        pipe.delete('resque:worker:%s' % worker_id,
+                'resque:worker:%s:started' % worker_id,
+                'resque:worker:%s:batch' % worker_id,
+                'resque:worker:%s:batch_queue' % worker_id,
+                'resque:stat:processed:%s' % worker_id,
+                'resque:stat:failed:%s' % worker_id,
+                heartbeat_key(worker_id))
+        logger.warning('reaped dead worker %s, %d jobs %s', worker_id,
+                len(inflight), requeue and 'requeued' or 'failed')
+    pipe.execute()
+    return ids, jobs
+
+class Reaper(threading.Thread):
+    '''
+    Daemon thread reaping dead workers every `interval` seconds
+    (the heartbeat TTL by default).
+    '''
+
+    def __init__(self, resq, interval=None, requeue=False):
+        super(Reaper, self).__init__(name='pyres-reaper')
+        self.daemon = True
+        self.resq = resq
+        self.interval = interval or heartbeat_ttl()
+        self.requeue = requeue
+
+    def run(self):
+        while True:
+            try:
+                reap(self.resq, self.requeue)
+            except Exception:
+                logger.exception('reaping dead workers failed')
+            time.sleep(self.interval)
@@ -0,0 +1,113 @@
+# core imports:
+import logging
+import os
+import socket
+import threading
+
+# pyres imports:
+from pyres import ResQ
+from pyres_scheduler import PyresScheduler
+
+# django framework imports:
+from django.conf import settings
+
+# project imports:
+from pyres_django.helpers import get_pyres
+
+logger = logging.getLogger(__name__)
+
+LEADER_KEY = 'resque:scheduler:leader'
+
+# KEYS: lease; ARGV: holder id, ttl. Extends the lease only if it is
+# still held by the caller, in one step.
+RENEW_LEASE = '''
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('expire', KEYS[1], ARGV[2])
+end
+return 0
+'''
+
+# registered periodic jobs: [(kind, job class, run_every)]
+_registry = []
+_scheduled = set()
+_scheduler = None
+_lock = threading.Lock()
+
+class LeaderResQ(ResQ):
+    '''
+    ResQ enqueueing jobs only while this process holds the scheduler
+    lease, so every scheduler tick is enqueued once per deployment no
+    matter how many processes run the scheduler.
+
+    The lease is a Redis key with a TTL (the PYRES_SCHEDULER_LEASE
+    settings variable, 60 seconds by default), taken with SET NX and
+    renewed by its holder on every tick with an atomic check-and-expire,
+    so a lease taken over by another process after it expired is never
+    extended by its former holder.
+    '''
+
+    def __init__(self, *args, **kwargs):
+        super(LeaderResQ, self).__init__(*args, **kwargs)
+        self.leader_id = '%s:%d' % (socket.gethostname(), os.getpid())
+
+    def is_leader(self):
+        ttl = getattr(settings, 'PYRES_SCHEDULER_LEASE', 60)
+        if self.redis.set(LEADER_KEY, self.leader_id, nx=True, ex=ttl):
+            logger.info('%s became the scheduler leader', self.leader_id)
+            return True
+        return bool(self.redis.eval(RENEW_LEASE, 1, LEADER_KEY,
+            self.leader_id, ttl))
+
+    def enqueue(self, klass, *args):
+        if self.is_leader():
+            super(LeaderResQ, self).enqueue(klass, *args)
+        else:
+            logger.debug('not the scheduler leader, skipping %s', klass)
+
+def register(klass, kind, run_every):
+    '''
+    Registers a periodic ("cron") or an "interval" job class.
+    Registering the same class twice has no effect.
+    '''
+    if kind not in ('cron', 'interval'):
+        raise ValueError('Unknown periodic job kind "%s"' % kind)
+    with _lock:
+        if not any(k == kind and c is klass for k, c, r in _registry):
+            _registry.append((kind, klass, run_every))
+
+def register_module(module):
+    '''
+    Registers all classes of a module whose names start with "Periodic"
+    (cron-like jobs) or "Interval" and which have a run_every attribute.
+    '''
+    for name in dir(module):
+        if name.startswith('Periodic'):
+            kind = 'cron'
+        elif name.startswith('Interval'):
+            kind = 'interval'
+        else:
+            continue
+        klass = getattr(module, name)
+        run_every = getattr(klass, 'run_every', None)
+        if isinstance(klass, type) and run_every is not None:
+            register(klass, kind, run_every)
+
+def start():
+    '''
+    Starts the scheduler thread of this process (once) and schedules
+    all registered jobs which are not scheduled yet.
+    '''
+    global _scheduler
+    with _lock:
+        if _scheduler is None:
+            _scheduler = PyresScheduler()
+            _scheduler.add_resque(get_pyres(LeaderResQ))
+            _scheduler.start()
+        for kind, klass, run_every in _registry:
+            if (kind, klass) in _scheduled:
+                continue
+            if kind == 'cron':
+                _scheduler.add_cron_job(klass, args=None, **run_every)
+            else:
+                _scheduler.add_interval_job(klass, args=None, **run_every)
+            _scheduled.add((kind, klass))
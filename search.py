@@ -0,0 +1,101 @@
+# core imports:
+import json
+import time
+
+# pyres imports:
+from pyres import ResQ
+
+# django framework imports:
+from django.conf import settings
+
+def _chunk_size():
+    return getattr(settings, 'PYRES_SEARCH_CHUNK_SIZE', 500)
+
+def _scan_list(resq, key, chunk):
+    # yields (index, raw item), one LRANGE per chunk
+    offset = 0
+    while True:
+        items = resq.redis.lrange(key, offset, offset + chunk - 1)
+        for i, item in enumerate(items):
+            yield offset + i, item
+        if len(items) < chunk:
+            return
+        offset += chunk
+
+def _decode(item):
+    # the decoded entry, None for corrupt or legacy ones
+    try:
+        decoded = ResQ.decode(item)
+    except (ValueError, TypeError):
+        return None
+    if not isinstance(decoded, dict):
+        return None
+    return decoded
+
+def _candidates(resq, sources, chunk):
+    '''
+    Yields (source, location, index, job payload) for every job
+    of the given sources: "queue:<name>", "delayed" or "failed".
+    Entries which can not be decoded are skipped.
+    '''
+    for source in sources:
+        if source.startswith('queue:'):
+            queue = source[len('queue:'):]
+            for i, item in _scan_list(resq, 'resque:queue:%s' % queue, chunk):
+                payload = _decode(item)
+                if payload is not None:
+                    yield 'queue', queue, i, payload
+        elif source == 'delayed':
+            offset = 0
+            while True:
+                timestamps = resq.redis.zrange('resque:delayed_queue_schedule',
+                        offset, offset + chunk - 1)
+                for t in timestamps:
+                    for i, item in _scan_list(resq, 'resque:delayed:%s' % t,
+                            chunk):
+                        payload = _decode(item)
+                        if payload is not None:
+                            yield 'delayed', t, i, payload
+                if len(timestamps) < chunk:
+                    break
+                offset += chunk
+        elif source == 'failed':
+            for i, item in _scan_list(resq, 'resque:failed', chunk):
+                failed = _decode(item) or {}
+                if isinstance(failed.get('payload'), dict):
+                    yield 'failed', failed.get('queue'), i, failed['payload']
+
+def search(resq, sources, cls=None, text=None, limit=100, budget=2.0,
+        chunk=None):
+    '''
+    Searches jobs whose class contains `cls` and whose arguments
+    contain `text` (both optional) within the given sources, see
+    _candidates().
+
+    Lists are read in chunks of `chunk` entries (the
+    PYRES_SEARCH_CHUNK_SIZE settings variable, 500 by default), so
+    Redis is never blocked by a single huge command. The search stops
+    after `limit` results or `budget` seconds, whichever comes first.
+
+    Returns (results, complete), where results is a list of dicts with
+    "source", "location", "index", "cls" and "args" keys, and complete
+    is False if the search was cut short.
+    '''
+    chunk = chunk or _chunk_size()
+    deadline = time.time() + budget
+    results = []
+    for source, location, index, payload in _candidates(resq, sources,
+            chunk):
+        if len(results) >= limit or time.time() > deadline:
+            return results, False
+        job_cls = payload.get('class') or ''
+        if not isinstance(job_cls, basestring):
+            continue
+        if cls and cls not in job_cls:
+            continue
+        args = json.dumps(payload.get('args'), default=repr)
+        if text and text not in args:
+            continue
+        results.append({'source': source, 'location': location,
+            'index': index, 'cls': job_cls, 'args': args})
+    return results, True
@@ -0,0 +1,84 @@
+# core imports:
+import json
+
+# pyres imports:
+from pyres import ResQ
+
+# django framework imports:
+from django.conf import settings
+from django.core.exceptions import ImproperlyConfigured
+
+# Payloads in the binary format start with this marker. JSON payloads
+# never do, so both formats can be mixed within the same queue.
+MSGPACK_MARKER = b'\x00mp'
+
+def _json():
+    return json.dumps, json.loads
+
+def _ujson():
+    try:
+        import ujson
+    except ImportError:
+        raise ImproperlyConfigured('PYRES_PAYLOAD_CODEC is "ujson", '
+                'but the ujson package is not installed')
+    # ujson produces plain JSON, so no marker is needed
+    return ujson.dumps, ujson.loads
+
+def _msgpack():
+    try:
+        import msgpack
+    except ImportError:
+        raise ImproperlyConfigured('PYRES_PAYLOAD_CODEC is "msgpack", '
+                'but the msgpack package is not installed')
+
+    def dumps(item):
+        return MSGPACK_MARKER + msgpack.packb(item, use_bin_type=True)
+
+    return dumps, None
+
+CODECS = {'json': _json, 'ujson': _ujson, 'msgpack': _msgpack}
+
+def _unpack(data):
+    import msgpack
+    try:
+        return msgpack.unpackb(data, raw=False)
+    except TypeError:
+        # msgpack < 0.5.2
+        return msgpack.unpackb(data, encoding='utf-8')
+
+_installed = False
+
+def install():
+    '''
+    Replaces ResQ.encode and ResQ.decode, which are used by pyres for
+    every payload, with the codec chosen by the PYRES_PAYLOAD_CODEC
+    settings variable ("json" (default), "ujson" or "msgpack").
+
+    Whatever codec is chosen, payloads in both formats are decoded,
+    so old JSON jobs and new binary ones can share a queue during
+    migration and the web interface shows all of them.
+    '''
+    global _installed
+    if _installed:
+        return
+
+    name = getattr(settings, 'PYRES_PAYLOAD_CODEC', 'json')
+    if name not in CODECS:
+        raise ImproperlyConfigured('Unknown PYRES_PAYLOAD_CODEC "%s"' % name)
+    dumps, loads = CODECS[name]()
+    loads = loads or json.loads
+
+    def encode(cls, item):
+        return dumps(item)
+
+    def decode(cls, item):
+        # like pyres, anything but a string (e.g. a missing key) is None
+        if not isinstance(item, basestring):
+            return None
+        if isinstance(item, bytes) and item.startswith(MSGPACK_MARKER):
+            return _unpack(item[len(MSGPACK_MARKER):])
+        return loads(item)
+
+    ResQ.encode = classmethod(encode)
+    ResQ.decode = classmethod(decode)
+    _installed = True
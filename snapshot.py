@@ -0,0 +1,75 @@
+# core imports:
+import time
+import uuid
+
+# pyres imports:
+from pyres import failure
+
+# django framework imports:
+from django.conf import settings
+from django.core.cache import cache
+
+# project imports:
+from pyres_django.helpers import queue_sizes, worker_snapshot
+
+# how long a refreshing request may hold the lock (seconds)
+LOCK_TIMEOUT = 10
+
+def build_snapshot(resq):
+    return {'time': time.time(),
+            'queues': queue_sizes(resq),
+            'workers': worker_snapshot(resq),
+            'fail_count': failure.count(resq)}
+
+def live_interval():
+    '''
+    Polling interval of the live dashboard updates in seconds,
+    the PYRES_LIVE_INTERVAL settings variable (0, the default,
+    disables them).
+    '''
+    return getattr(settings, 'PYRES_LIVE_INTERVAL', 0)
+
+def get_snapshot(resq, interval=None):
+    '''
+    Returns queue sizes, worker states and the failure count shared
+    by all dashboard viewers, or None if sharing is disabled.
+
+    The snapshot is stored in django's cache framework and refreshed at
+    most once per `interval` seconds, the PYRES_SNAPSHOT_INTERVAL
+    settings variable by default (0, the default, disables it). Only
+    the request which acquires the lock refreshes the snapshot; the
+    others keep serving the previous one meanwhile. The lock is only
+    released by its holder, so a refresh outliving LOCK_TIMEOUT never
+    releases the lock of the next one.
+    '''
+    if interval is None:
+        interval = getattr(settings, 'PYRES_SNAPSHOT_INTERVAL', 0)
+    if not interval:
+        return None
+
+    key = 'pyres_django:snapshot:%s:%s' % (resq.host, resq.port)
+    snapshot = cache.get(key)
+    if snapshot and time.time() - snapshot['time'] < interval:
+        return snapshot
+
+    token = uuid.uuid4().hex
+    if cache.add(key + ':lock', token, LOCK_TIMEOUT):
+        try:
+            snapshot = build_snapshot(resq)
+            # kept longer than the interval to be served while refreshing
+            cache.set(key, snapshot, interval + LOCK_TIMEOUT)
+        finally:
+            # the lock may have expired and been taken by another request
+            if cache.get(key + ':lock') == token:
+                cache.delete(key + ':lock')
+        return snapshot
+
+    if snapshot:
+        return snapshot
+    # no snapshot yet and another request builds it: wait for it a bit
+    for i in range(20):
+        time.sleep(0.05)
+        snapshot = cache.get(key)
+        if snapshot:
+            return snapshot
+    return build_snapshot(resq)
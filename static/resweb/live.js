@@ -0,0 +1,70 @@
+// Live dashboard updates: polls the JSON endpoint and patches
+// the queues and working tables instead of reloading the page.
+// live_url, live_static_url and live_interval (seconds) are set
+// by the page.
+
+$(function() {
+
+  var queues = $('#live-queues')
+  var working = $('#live-working')
+  if (!queues.length && !working.length) return
+
+  var version = ''
+
+  function esc(s) {
+    return $('<div/>').text(s == null ? '' : String(s)).html()
+  }
+
+  function patch_queues(data) {
+    var known = queues.find('tr[data-queue]')
+    if (known.length != data.length) {
+      // queues were added or removed
+      window.location.reload()
+      return
+    }
+    $.each(data, function(i, q) {
+      // compared as a string, so any queue name is safe
+      var row = known.filter(function() {
+        return $(this).attr('data-queue') === q.queue
+      })
+      if (!row.length) {
+        window.location.reload()
+        return false
+      }
+      row.find('td.size').text(q.size)
+    })
+  }
+
+  function patch_working(data) {
+    $('.live-working').text(data.workers.length)
+    $('.live-total').text(data.total)
+    working.find('tr:gt(0)').remove()
+    if (!data.workers.length) {
+      working.append("<tr><td colspan='4' class='no-data'>Nothing is happening right now...</td></tr>")
+      return
+    }
+    var icon = live_static_url + 'working.png'
+    $.each(data.workers, function(i, w) {
+      working.append('<tr>' +
+        "<td class='icon'><img src='" + icon + "' alt='working' title='working'></td>" +
+        "<td class='where'><a href='" + esc(w.url) + "'>" + esc(w.host) + ':' + esc(w.pid) + '</a></td>' +
+        "<td class='queues queue'><a class='queue-tag' href='" + esc(w.queue_url) + "'>" + esc(w.queue) + '</a></td>' +
+        "<td class='process'><code>" + esc(w.code) + '</code> <small>' + esc(w.runat) + '</small></td>' +
+        '</tr>')
+    })
+  }
+
+  function poll() {
+    $.ajax({dataType:'json', type:'get', url:live_url, data:{version:version},
+      success:function(data) {
+        version = data.version
+        if (data.queues && queues.length) patch_queues(data.queues)
+        if (data.failed && queues.length) queues.find('tr.failed td.size').text(data.failed.count)
+        if (data.working && working.length) patch_working(data.working)
+      },
+      complete:function() { setTimeout(poll, live_interval * 1000) }
+    })
+  }
+
+  poll()
+})
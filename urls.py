@@ -6,6 +6,8 @@ urlpatterns = patterns('pyres_django.views',
 
     url(r'^working/$', 'working', name='resweb-working'),
 
+    url(r'^live/$', 'live', name='resweb-live'),
+
     url(r'^queues/$', 'queues', name='resweb-queues'),
     url(r'^queues/(?P<queue_id>\w.+)/$', 'queue',
         name='resweb-queue'),
@@ -22,6 +24,9 @@ urlpatterns = patterns('pyres_django.views',
         name='resweb-delete-all-failed'),
     url(r'^failed/retry_all/$', 'retry_failed',
         name='resweb-retry-all-failed'),
+    url(r'^failed/bulk/$', 'bulk_failed', name='resweb-bulk-failed'),
+
+    url(r'^search/$', 'search_jobs', name='resweb-search'),
 
     url(r'^workers/$', 'workers', name='resweb-workers'),
     url(r'^workers/(?P<worker_id>\w.+)/$', 'worker',
@@ -1,21 +1,35 @@
 # core imports
 import datetime
+import json
+import logging
+from hashlib import md5
 from base64 import b64decode
 
 # django framework imports
 from django.conf import settings
+from django.core.urlresolvers import reverse
 from django.shortcuts import redirect, render
 from django.utils.decorators import method_decorator
 from django.views.decorators.http import require_POST
 from django.views.generic.base import TemplateView
-from django.http import Http404
+from django.http import Http404, HttpResponse
 
 # pyres imports
-from pyres import ResQ, failure, __version__
+from pyres import failure, __version__
 from pyres.worker import Worker as Wrkr
 
 # project imports
-from pyres_django.helpers import (WebContainer, redis_size, get_pyres)
+from pyres_django.helpers import (WebContainer, redis_size, inspect_keys,
+        resque_keys, get_pyres, delayed_sizes, delayed_histogram,
+        worker_snapshot, queue_sizes, memoized, RedisCounter)
+from pyres_django import metrics
+from pyres_django.snapshot import get_snapshot, live_interval
+from pyres_django.search import search
+from pyres_django.failures import (retry_all, summary,
+        process as process_failed, retry as retry_failed_job,
+        remove as remove_failed_job, SUMMARY_KEY)
+
+logger = logging.getLogger(__name__)
 
 #########################################################################
 #
@@ -67,6 +81,8 @@ def smart_auth(view):
 class ReswebView(TemplateView):
 
     _items_per_page = 20
+    # number of pages shown on each side of the current one
+    _page_window = 5
 
     ################### pyres methods: ###########################
 
@@ -74,30 +90,48 @@ class ReswebView(TemplateView):
         return __version__
 
     def address(self):
+        if not self.resq.port:
+            # unix socket
+            return self.resq.host
         return '%s:%d' % (self.resq.host, self.resq.port)
 
+    @memoized
     def page_range(self):
+        '''
+        Returns the pages around the current one plus the first and
+        the last page; skipped ranges are marked with gap=True.
+        '''
         size = self.size()
         items_per_page = self._items_per_page
-        start = self._start
-        if size < items_per_page:
+        if size <= items_per_page:
             return []
 
-        num_pages = size / items_per_page
-        if size % items_per_page > 0:
-            num_pages += 1
+        num_pages = (size + items_per_page - 1) // items_per_page
+        current = self._start // items_per_page
+        window = self._page_window
+        indexes = set([0, num_pages - 1]) | set(range(max(current - window,
+            0), min(current + window + 1, num_pages)))
 
         pages = []
-        for i in range(num_pages):
-            inum = i * num_pages
-            if inum == start:
-                current = True
-            else:
-                current = False
-            pages.append(WebContainer(current=current, start=inum,
-                index=i+1))
+        previous = None
+        for i in sorted(indexes):
+            if previous is not None and i > previous + 1:
+                pages.append(WebContainer(gap=True))
+            inum = i * items_per_page
+            pages.append(WebContainer(current=i == current,
+                start=inum, index=i+1))
+            previous = i
         return pages
 
+    @memoized
+    def _snapshot(self):
+        # shared across viewers, if enabled in settings
+        return get_snapshot(self.resq)
+
+    def live_interval(self):
+        # pages listing it in _keys poll the live view, if enabled
+        return live_interval()
+
     def start(self):
         return self._start
 
@@ -113,15 +147,21 @@ class ReswebView(TemplateView):
         context = super(ReswebView, self).get_context_data(**kwargs)
         for k in self._get_keys():
             context[k] = getattr(self, k)()
+        context['redis_commands'] = self.redis_counter.commands
+        context['redis_round_trips'] = self.redis_counter.round_trips
+        logger.debug('%s: %d redis round trips, %d commands',
+                self.__class__.__name__, self.redis_counter.round_trips,
+                self.redis_counter.commands)
         return context
 
     @method_decorator(smart_auth)
     def dispatch(self, request, *args, **kwargs):
         self.resq = get_pyres()
+        self.redis_counter = RedisCounter(self.resq.redis)
         if getattr(self, '_paginated', False):
             start = request.GET.get('start', 0)
             try:
-                start = int(start)
+                start = max(int(start), 0)
             except ValueError:
                 start = 0
             self._start = start
@@ -138,37 +178,41 @@ class ReswebView(TemplateView):
 
 class WorkingMixin(object):
 
+    @memoized
+    def _worker_snapshot(self):
+        # shared by all context methods within a single request
+        snapshot = self._snapshot()
+        if snapshot:
+            return snapshot['workers']
+        return worker_snapshot(self.resq)
+
     def all_workers(self):
-        return Wrkr.all(self.resq)
+        return self._worker_snapshot()
 
     def total_workers(self):
         return len(self.all_workers())
 
+    @memoized
     def workers(self):
-        workers = []
-        for w in self.resq.working():
-            data = w.processing()
-            host, pid, queues = str(w).split(':')
-            item = {'state':w.state(),
-                    'host':host,
-                    'pid':pid,
-                    'w':w,
-                    'queue':w.job().get('queue')}
-            if 'queue' in data:
-                item['data'] = True
-                item['code'] = data['payload']['class']
-                item['runat'] = datetime.datetime.fromtimestamp(float(data['run_at']))
-            workers.append(WebContainer(**item))
-        return workers
+        return [w for w in self._worker_snapshot() if w.state == 'working']
 
 #########################################################################
 
 class QueuesMixin(object):
+    @memoized
     def queues(self):
-        return [WebContainer(q=q, size=self.resq.size(q)) for q in
-                sorted(self.resq.queues())]
-
+        snapshot = self._snapshot()
+        if snapshot:
+            sizes = snapshot['queues']
+        else:
+            sizes = queue_sizes(self.resq)
+        return [WebContainer(q=q, size=size) for q, size in sizes]
+
+    @memoized
     def fail_count(self):
+        snapshot = self._snapshot()
+        if snapshot:
+            return snapshot['fail_count']
         return failure.count(self.resq)
 
 
@@ -180,7 +224,8 @@ class QueuesMixin(object):
 
 class Overview(ReswebView, WorkingMixin, QueuesMixin):
     template_name = 'resweb/overview.html'
-    _keys = ('queues', 'fail_count', 'workers', 'total_workers')
+    _keys = ('queues', 'fail_count', 'workers', 'total_workers',
+            'live_interval')
 
 overview = Overview.as_view()
 
@@ -188,7 +233,7 @@ overview = Overview.as_view()
 
 class Working(ReswebView, WorkingMixin):
     template_name = 'resweb/working.html'
-    _keys = ('workers', 'total_workers')
+    _keys = ('workers', 'total_workers', 'live_interval')
 
 working = Working.as_view()
 
@@ -196,22 +241,82 @@ working = Working.as_view()
 
 class Queues(ReswebView, QueuesMixin):
     template_name = 'resweb/queues.html'
-    _keys = ('queues', 'fail_count')
+    _keys = ('queues', 'fail_count', 'live_interval')
 
 queues = Queues.as_view()
 
 #########################################################################
 
+class Live(ReswebView, WorkingMixin, QueuesMixin):
+    '''
+    JSON data for live dashboard updates.
+
+    The "version" GET parameter is the token returned by the previous
+    call; only the sections which changed since then are returned,
+    so polling clients patch the page instead of reloading it.
+
+    Only available if PYRES_LIVE_INTERVAL is set. The data always
+    comes from the shared snapshot, refreshed at most once per
+    interval whatever the number of polling pages.
+    '''
+    _sections = ('queues', 'working', 'failed')
+
+    @memoized
+    def _snapshot(self):
+        return get_snapshot(self.resq, max(live_interval(),
+            getattr(settings, 'PYRES_SNAPSHOT_INTERVAL', 0)))
+
+    def _live_queues(self):
+        return [{'queue': q.q, 'size': q.size,
+            'url': reverse('resweb-queue', args=[q.q])}
+            for q in self.queues()]
+
+    def _live_working(self):
+        return {'total': self.total_workers(),
+                'workers': [{'host': w.host, 'pid': w.pid,
+                    'queue': w.queue, 'code': getattr(w, 'code', None),
+                    'runat': w.runat.isoformat() if getattr(w, 'data',
+                        False) else None,
+                    'url': reverse('resweb-worker', args=[w.w]),
+                    'queue_url': reverse('resweb-queue', args=[w.queue])}
+                    for w in self.workers()]}
+
+    def _live_failed(self):
+        return {'count': self.fail_count()}
+
+    def get(self, request, *args, **kwargs):
+        if not live_interval():
+            raise Http404
+        known = request.GET.get('version', '').split('.')
+        versions = []
+        data = {}
+        for i, name in enumerate(self._sections):
+            value = getattr(self, '_live_' + name)()
+            version = md5(json.dumps(value, sort_keys=True)).hexdigest()[:12]
+            versions.append(version)
+            if i >= len(known) or known[i] != version:
+                data[name] = value
+        data['version'] = '.'.join(versions)
+        return HttpResponse(json.dumps(data),
+                content_type='application/json')
+
+live = Live.as_view()
+
+#########################################################################
+
 class Queue(ReswebView, QueuesMixin):
     template_name = 'resweb/queue.html'
     _keys = ('queue', 'size', 'jobs', 'start', 'end', 'queues',
             'page_range')
     _paginated = True
 
+    @memoized
     def jobs(self):
         return [WebContainer(cls=j['class'], args=','.join([''.join(str(x)) for x in j['args']])) for j in
-                self.resq.peek(self.queue(), self._start, self._end)]
+                self.resq.peek(self.queue(), self._start,
+                    self._items_per_page)]
 
+    @memoized
     def size(self):
         #return self.resq.size(self.kwargs['queue_id']) or 0
         return self.resq.size(self.queue()) or 0
@@ -223,14 +328,59 @@ queue = Queue.as_view()
 
 #########################################################################
 
+class Search(ReswebView, QueuesMixin):
+    template_name = 'resweb/search.html'
+    _keys = ('queues', 'query', 'results')
+    _search_limit = 100
+    # seconds
+    _search_budget = 2.0
+
+    @memoized
+    def query(self):
+        params = self.request.GET
+        return WebContainer(cls=params.get('cls', '').strip(),
+                text=params.get('text', '').strip(),
+                sources=params.getlist('source'))
+
+    @memoized
+    def results(self):
+        query = self.query()
+        if not query.sources or not (query.cls or query.text):
+            return None
+        results, complete = search(self.resq, query.sources,
+                query.cls or None, query.text or None,
+                self._search_limit, self._search_budget)
+        items = []
+        for r in results:
+            # offset of the page showing the job
+            r['start'] = r['index'] - r['index'] % self._items_per_page
+            items.append(WebContainer(**r))
+        return WebContainer(complete=complete, items=items)
+
+search_jobs = Search.as_view()
+
+#########################################################################
+
 class Failed(ReswebView):
     template_name = 'resweb/failed.html'
-    _keys = ('start', 'end', 'failed_jobs', 'size', 'page_range')
+    _keys = ('start', 'end', 'failed_jobs', 'size', 'page_range',
+            'summary')
     _paginated = True
-
+    _summary_rows = 10
+
+    @memoized
+    def summary(self):
+        groups = summary(self.resq)
+        return [WebContainer(title=title, rows=[WebContainer(value=k, **v)
+            for k, v in sorted(groups[field].items(),
+                key=lambda i: -i[1]['count'])[:self._summary_rows]])
+            for field, title in (('class', 'Class'),
+                ('exception', 'Exception'), ('queue', 'Queue'))]
+
+    @memoized
     def failed_jobs(self):
         jobs = []
-        for j in failure.all(self.resq, self._start, self._end):
+        for j in failure.all(self.resq, self._start, self._end - 1):
             backtrace = j['backtrace']
             if isinstance(backtrace, list):
                 j['backtrace'] = '\n'.join(backtrace)
@@ -240,6 +390,7 @@ class Failed(ReswebView):
             jobs.append(WebContainer(**j))
         return jobs
 
+    @memoized
     def size(self):
         return failure.count(self.resq) or 0
 
@@ -247,27 +398,12 @@ failed = Failed.as_view()
 
 #########################################################################
 
-class Workers(ReswebView):
+class Workers(ReswebView, WorkingMixin):
     template_name = 'resweb/workers.html'
     _keys = ('workers',)
 
     def workers(self):
-        workers = []
-        for w in Wrkr.all(self.resq):
-            data = w.processing()
-            host, pid, queues = str(w).split(':')
-            item = {'state':w.state(),
-                    'host':host,
-                    'pid':pid,
-                    'w':w,
-                    'queues':queues.split(','),
-                    'queue':w.job().get('queue')}
-            if 'queue' in data:
-                item['data'] = True
-                item['code'] = data['payload']['class']
-                item['runat'] = datetime.datetime.fromtimestamp(float(data['run_at']))
-            workers.append(WebContainer(**item))
-        return workers
+        return self.all_workers()
 
 workers = Workers.as_view()
 
@@ -277,6 +413,7 @@ class Worker(ReswebView):
     template_name = 'resweb/worker.html'
     _keys = ('worker',)
 
+    @memoized
     def worker(self):
         worker = Wrkr.find(self.kwargs['worker_id'], self.resq)
         if not worker:
@@ -294,11 +431,14 @@ worker = Worker.as_view()
 
 class Stats(ReswebView):
     template_name = 'resweb/stats.html'
-    _keys = ('key', 'stats', 'key_title')
+    _keys = ('key', 'stats', 'key_title', 'start', 'end', 'size',
+            'page_range')
+    _paginated = True
 
     def key(self):
         return self.kwargs['key']
 
+    @memoized
     def stats(self):
         key = self.key()
         if key == 'resque':
@@ -306,11 +446,46 @@ class Stats(ReswebView):
         if key == 'redis':
             return [ WebContainer(key=k, value=v) for k,v in self.resq.redis.info().iteritems() ]
         if key == 'keys':
-            return [ WebContainer(key=k,
-                type=self.resq.redis.type('resque:'+k),
-                size=redis_size(self.resq, k)) for k in self.resq.keys() ]
+            keys = self._all_keys()[self._start:self._end]
+            return [ WebContainer(key=k, type=t, size=s) for k, t, s in
+                inspect_keys(self.resq, keys) ]
+        if key == 'metrics':
+            return self._metrics()
         return []
 
+    # resolution: number of buckets shown
+    _metrics_buckets = {'1m': 60, '1h': 48}
+
+    def _metrics(self):
+        resolution = self.request.GET.get('resolution')
+        if resolution not in self._metrics_buckets:
+            resolution = '1m'
+        buckets = self._metrics_buckets[resolution]
+        length = dict((r[0], r[1]) for r in metrics.RESOLUTIONS)[resolution]
+        series, queues, classes = metrics.report(self.resq, resolution,
+                buckets)
+        peak = max([p for t, p, f in series] + [1])
+        return WebContainer(resolution=resolution,
+                resolutions=sorted(self._metrics_buckets),
+                series=[WebContainer(
+                    time=datetime.datetime.fromtimestamp(t),
+                    processed=p, failed=f, rate=p / float(length),
+                    width=100 * p / peak) for t, p, f in reversed(series)],
+                queues=[WebContainer(queue=q, **v) for q, v in
+                    sorted(queues.items())],
+                classes=[WebContainer(cls=c, **v) for c, v in
+                    sorted(classes.items())])
+
+    @memoized
+    def _all_keys(self):
+        return resque_keys(self.resq)
+
+    @memoized
+    def size(self):
+        if self.key() == 'keys':
+            return len(self._all_keys())
+        return 0
+
     def key_title(self):
         # TODO
         # translation;
@@ -322,6 +497,8 @@ class Stats(ReswebView):
             return self.address()
         if k == 'keys':
             return 'Keys owned by Pyres'
+        if k == 'metrics':
+            return 'Throughput and latency'
         return k
 
 stats = Stats.as_view()
@@ -335,6 +512,7 @@ class Stat(ReswebView):
     def key(self):
         return self.kwargs['stat_id']
 
+    @memoized
     def key_type(self):
         # return value seems str
         return self.resq.redis.type(self._rk())
@@ -342,9 +520,12 @@ class Stat(ReswebView):
     def _rk(self):
         return 'resque:' + self.kwargs['stat_id']
 
+    @memoized
     def size(self):
-        return redis_size(self.resq, self.kwargs['stat_id'])
+        return redis_size(self.resq, self.kwargs['stat_id'],
+                self.key_type())
 
+    @memoized
     def stat_items(self):
         #kt = str(self.key_type())
         kt = self.key_type()
@@ -363,16 +544,40 @@ stat = Stat.as_view()
 
 class Delayed(ReswebView):
     template_name = 'resweb/delayed.html'
-    _keys = ('size', 'jobs', 'start', 'end', 'page_range')
+    _keys = ('size', 'jobs', 'start', 'end', 'page_range', 'histogram')
     _paginated = True
+    # resolution: (bucket length in seconds, number of buckets)
+    _histograms = {'minute': (60, 60), 'hour': (3600, 48)}
 
+    @memoized
     def size(self):
-        return self.resq.delayed_queue_schedule_size() or 0
+        # number of timestamps, not jobs: summing the jobs up would
+        # take a round trip per timestamp
+        return self.resq.redis.zcard('resque:delayed_queue_schedule') or 0
 
+    @memoized
     def jobs(self):
-        return [WebContainer(timestamp=datetime.datetime.fromtimestamp(float(t)),
-            size=self.resq.delayed_timestamp_size(t)) for t in
-            self.resq.delayed_queue_peek(self._start, self._end)]
+        # not delayed_queue_peek(): its end index is one past the page
+        timestamps = [int(t) for t in self.resq.redis.zrange(
+            'resque:delayed_queue_schedule', self._start,
+            self._start + self._items_per_page - 1)]
+        return [WebContainer(key=t,
+            timestamp=datetime.datetime.fromtimestamp(float(t)), size=s)
+            for t, s in zip(timestamps, delayed_sizes(self.resq, timestamps))]
+
+    @memoized
+    def histogram(self):
+        resolution = self.request.GET.get('resolution')
+        if resolution not in self._histograms:
+            resolution = 'minute'
+        counts, complete = delayed_histogram(self.resq,
+                *self._histograms[resolution])
+        peak = max([c for s, c in counts] + [1])
+        return WebContainer(resolution=resolution,
+                resolutions=sorted(self._histograms), complete=complete,
+                buckets=[WebContainer(start=s and
+                    datetime.datetime.fromtimestamp(s), count=c,
+                    width=100 * c / peak) for s, c in counts])
 
 delayed = Delayed.as_view()
 
@@ -380,24 +585,33 @@ delayed = Delayed.as_view()
 
 class DelayedTimestamp(ReswebView):
     template_name = 'resweb/delayed_timestamp.html'
-    _keys = ('start', 'end', 'jobs', 'size', 'timestamp', 'page_range')
+    _keys = ('start', 'end', 'jobs', 'size', 'timestamp', 'when',
+            'page_range')
     _paginated = True
 
+    @memoized
     def jobs(self):
         return [WebContainer(cls=j['class'], args=j['args']) for j in
                 self.resq.delayed_timestamp_peek(self.timestamp(),
-                    self._start, self._end)]
+                    self._start, self._items_per_page)]
         #jobs = []
         #for j in resq.delayed_timestamp_peek(timestamp, start, end):
         #    jobs.append(WebContainer(cls=j['class'], args=j['args']))
         #return jobs
 
+    @memoized
     def size(self):
-        return resq.delayed_timestamp_size(self.timestamp()) or 0
+        return self.resq.delayed_timestamp_size(self.timestamp()) or 0
 
     def timestamp(self):
         return self.kwargs['timestamp']
 
+    def when(self):
+        try:
+            return datetime.datetime.fromtimestamp(float(self.timestamp()))
+        except ValueError:
+            raise Http404
+
 delayed_timestamp = DelayedTimestamp.as_view()
 
 #########################################################################
@@ -416,11 +630,10 @@ def failed_job(request, retry=False):
     job = b64decode(failed_job_)
     if retry:
         # post /failed/retry
-        decoded = ResQ.decode(job)
-        failure.retry(get_pyres(), decoded['queue'], job)
+        retry_failed_job(get_pyres(), job)
     else:
         # post /failed/delete
-        failure.delete(get_pyres(), job)
+        remove_failed_job(get_pyres(), job)
     return redirect('resweb-failed')
 
 #########################################################################
@@ -430,19 +643,35 @@ def delete_all_failed(request):
     # get /failed/delete_all
     resq = get_pyres()
     resq.redis.rename('resque:failed', 'resque:failed-staging')
-    resq.redis.delete('resque:failed-staging')
+    resq.redis.delete('resque:failed-staging', SUMMARY_KEY)
     return redirect('resweb-failed')
 
 #########################################################################
 
 @smart_auth
-def retry_failed(request, number=5000):
+def retry_failed(request):
     # get /failed/retry_all
-    resq = get_pyres()
-    failures = failure.all(resq, 0, number)
-    for f in failures:
-        j = b64decode(f['redis_value'])
-        failure.retry(resq, f['queue'], j)
+    retried = retry_all(get_pyres(), progress=lambda done, total:
+            logger.debug('retried %d of %d failed jobs', done, total))
+    logger.info('retried %d failed jobs', retried)
+    return redirect('resweb-failed')
+
+#########################################################################
+
+@smart_auth
+@require_POST
+def bulk_failed(request):
+    # post /failed/bulk
+    action = request.POST.get('action')
+    if action not in ('retry', 'delete'):
+        raise Http404
+    filters = {}
+    for name in ('class', 'queue', 'exception'):
+        value = request.POST.get(name, '').strip()
+        if value:
+            filters[name] = value
+    done = process_failed(get_pyres(), action, filters)
+    logger.info('%s: %d failed jobs matching %r', action, done, filters)
     return redirect('resweb-failed')
 
 #########################################################################
@@ -0,0 +1,392 @@
+# core imports:
+import errno
+import json
+import logging
+import os
+import random
+import threading
+import time
+
+# pyres imports:
+from pyres import ResQ
+from pyres import safe_str_to_class
+from pyres.exceptions import CrashError
+from pyres.job import Job
+from pyres.worker import Worker
+
+# project imports:
+from pyres_django import metrics
+from pyres_django import reaper
+from pyres_django.helpers import close_db_connections
+
+logger = logging.getLogger(__name__)
+
+QUEUE_PREFIX = 'resque:queue:'
+
+# KEYS: queue, batch, batch queue; ARGV: count, queue name. Moves up to
+# `count` jobs from the head of the queue to the batch at once, so a job
+# is never lost in between, and returns the whole batch.
+POP_BATCH = '''
+local count = tonumber(ARGV[1])
+if count > 0 then
+    local jobs = redis.call('lrange', KEYS[1], 0, count - 1)
+    if #jobs > 0 then
+        redis.call('ltrim', KEYS[1], #jobs, -1)
+        redis.call('rpush', KEYS[2], unpack(jobs))
+        redis.call('set', KEYS[3], ARGV[2])
+    end
+end
+return redis.call('lrange', KEYS[2], 0, -1)
+'''
+
+# job classes resolved by this process: {class string: class}
+_job_classes = {}
+
+def cached_str_to_class(s):
+    klass = _job_classes.get(s)
+    if klass is None:
+        klass = _job_classes[s] = safe_str_to_class(s)
+    return klass
+
+class CachedJob(Job):
+    '''
+    Job resolving every class string only once per process.
+
+    The class is resolved as soon as the job is reserved, i.e. in the
+    worker process before it forks, so the job module is imported there
+    the first time the class is seen and shared by all later children.
+    '''
+    safe_str_to_class = staticmethod(cached_str_to_class)
+
+    def __init__(self, *args, **kwargs):
+        super(CachedJob, self).__init__(*args, **kwargs)
+        try:
+            cached_str_to_class(self._payload['class'])
+        except Exception:
+            # the child reports the error as a job failure
+            logger.debug('can not resolve %s', self._payload.get('class'))
+
+def _sample(job, started, failed):
+    # (queue, class, runtime, wait, failed) as expected by metrics.record
+    enqueued = job._payload.get('enqueue_timestamp')
+    return (job._queue, job._payload['class'], time.time() - started,
+            enqueued and started - enqueued, failed)
+
+class MetricsMixin(object):
+    '''
+    Records throughput, runtime and queue wait time of every job
+    processed by the worker. See pyres_django.metrics.
+    '''
+
+    def process(self, job=None):
+        started = time.time()
+        self._job_failed = False
+        try:
+            return super(MetricsMixin, self).process(job)
+        finally:
+            if job is not None:
+                self.record_samples([_sample(job, started,
+                    self._job_failed)])
+
+    def _handle_job_exception(self, job):
+        self._job_failed = True
+        super(MetricsMixin, self)._handle_job_exception(job)
+
+    def record_samples(self, samples):
+        metrics.record(self.resq, samples)
+
+class HeartbeatMixin(object):
+    '''
+    Sends a heartbeat while the worker is registered, so that
+    pyres_django.reaper can tell dead workers from live ones.
+    '''
+
+    def register_worker(self):
+        super(HeartbeatMixin, self).register_worker()
+        reaper.heartbeat(self.resq).add(str(self))
+
+    def unregister_worker(self):
+        reaper.heartbeat(self.resq).remove(str(self))
+        super(HeartbeatMixin, self).unregister_worker()
+
+    def after_fork(self, job):
+        reaper.after_fork()
+        super(HeartbeatMixin, self).after_fork(job)
+
+class BlockingWorker(Worker):
+    '''
+    Worker waiting for jobs with a single BLPOP over all of its queues
+    instead of polling them in turn and sleeping in between.
+
+    BLPOP checks the keys in the given order, so queue priority is kept.
+    Jobs are picked up as soon as they are pushed, and an idle worker
+    sends one command per `interval` seconds.
+    '''
+
+    job_class = CachedJob
+
+    def reserve(self, timeout=10):
+        # zero timeout would block forever and never check for shutdown
+        ret = self.resq.redis.blpop([QUEUE_PREFIX + q for q in self.queues],
+                timeout=max(int(timeout or 0), 1))
+        if not ret:
+            return None
+        key, payload = ret
+        job = self.job_class(key[len(QUEUE_PREFIX):], ResQ.decode(payload),
+                self.resq, str(self))
+        logger.info('Found job on %s: %s', job._queue, job)
+        return job
+
+    def work(self, interval=5):
+        logger.info('starting')
+        self.startup()
+        while not self._shutdown:
+            try:
+                job = self.reserve(interval)
+            except Exception:
+                # a signal may interrupt the blocking call
+                if self._shutdown:
+                    break
+                raise
+            if job:
+                self.fork_worker(job)
+        logger.info('shutdown scheduled')
+        self.unregister_worker()
+
+class BatchWorker(BlockingWorker):
+    '''
+    Worker fetching up to `batch_size` jobs of a queue per round trip
+    and running them one after another in a single forked child.
+
+    Fork, worker registration and stats updates are paid once per batch
+    instead of once per job. The jobs of the batch not finished yet are
+    recorded under "resque:worker:<id>:batch" (and their queue under
+    "resque:worker:<id>:batch_queue"), written along with the pop.
+    The child removes every finished job from there, then reports it
+    through a pipe, so if it crashes the job it was running is failed
+    and the rest of the batch is pushed back to the head of the queue.
+
+    When all queues are empty, the worker waits for the next job with
+    BRPOPLPUSH into the batch, which blocks on a single queue: it
+    blocks on each queue in turn, for its share of the interval.
+    '''
+
+    batch_size = 10
+
+    def __init__(self, *args, **kwargs):
+        self.batch_size = kwargs.pop('batch_size', self.batch_size)
+        super(BatchWorker, self).__init__(*args, **kwargs)
+
+    def batch_key(self):
+        return 'resque:worker:%s:batch' % self
+
+    def batch_queue_key(self):
+        return 'resque:worker:%s:batch_queue' % self
+
+    def _pop_many(self, queue, count):
+        return [ResQ.decode(i) for i in self.resq.redis.eval(POP_BATCH, 3,
+            QUEUE_PREFIX + queue, self.batch_key(), self.batch_queue_key(),
+            count, queue)]
+
+    def _wait(self, timeout):
+        # the queue is recorded first, so a job moved to the batch
+        # is never without it
+        share = max(int(timeout or 0) // len(self.queues), 1)
+        for queue in self.queues:
+            self.resq.redis.set(self.batch_queue_key(), queue)
+            if self.resq.redis.brpoplpush(QUEUE_PREFIX + queue,
+                    self.batch_key(), share) is not None:
+                return queue
+        return None
+
+    def reserve_batch(self, timeout=10):
+        for queue in self.queues:
+            payloads = self._pop_many(queue, self.batch_size)
+            if payloads:
+                break
+        else:
+            # every queue is empty: wait for the next job
+            queue = self._wait(timeout)
+            if queue is None:
+                return []
+            payloads = self._pop_many(queue, self.batch_size - 1)
+
+        logger.info('Found %d jobs on %s', len(payloads), queue)
+        return [self.job_class(queue, p, self.resq, str(self))
+                for p in payloads]
+
+    def work(self, interval=5):
+        logger.info('starting')
+        self.startup()
+        while not self._shutdown:
+            try:
+                jobs = self.reserve_batch(interval)
+            except Exception:
+                # a signal may interrupt the blocking call
+                if self._shutdown:
+                    break
+                raise
+            if jobs:
+                self.fork_batch(jobs)
+        logger.info('shutdown scheduled')
+        self.unregister_worker()
+
+    def fork_batch(self, jobs):
+        logger.debug('picked up %d jobs', len(jobs))
+        rfd, wfd = os.pipe()
+        self.child = os.fork()
+        if not self.child:
+            os.close(rfd)
+            self.after_fork(jobs[0])
+            random.seed()
+            self.process_batch(jobs, wfd)
+            os._exit(0)
+
+        os.close(wfd)
+        done = 0
+        while True:
+            try:
+                chunk = os.read(rfd, 1024)
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            if not chunk:
+                break
+            done += len(chunk)
+        os.close(rfd)
+
+        while True:
+            try:
+                pid, status = os.waitpid(self.child, 0)
+                break
+            except OSError as e:
+                if e.errno != errno.EINTR:
+                    raise
+        self.child = None
+
+        if done < len(jobs):
+            self._recover_batch(jobs, done, status)
+        else:
+            self.resq.redis.delete(self.batch_key(), self.batch_queue_key())
+
+    def _working_data(self, job):
+        # the worker key, as written by Worker.working_on()
+        return json.dumps({'queue': job._queue,
+            'run_at': str(int(time.time())), 'payload': job._payload})
+
+    def process_batch(self, jobs, fd):
+        worker_key = 'resque:worker:%s' % self
+        self.resq.redis.set(worker_key, self._working_data(jobs[0]))
+        samples = []
+        for i, job in enumerate(jobs):
+            started = time.time()
+            failed = False
+            try:
+                job.perform()
+            except Exception:
+                failed = True
+                self._handle_job_exception(job)
+            samples.append(_sample(job, started, failed))
+            # one round trip: the job leaves the batch before it is
+            # reported as done, and the next one shows as running
+            pipe = self.resq.redis.pipeline(transaction=False)
+            pipe.lpop(self.batch_key())
+            if i + 1 < len(jobs):
+                pipe.set(worker_key, self._working_data(jobs[i + 1]))
+            pipe.execute()
+            os.write(fd, '.')
+        self.record_samples(samples)
+
+        pipe = self.resq.redis.pipeline(transaction=False)
+        pipe.incr('resque:stat:processed', len(jobs))
+        pipe.incr('resque:stat:processed:%s' % self, len(jobs))
+        pipe.delete('resque:worker:%s' % self)
+        pipe.execute()
+
+    def _recover_batch(self, jobs, done, status):
+        crashed, rest = jobs[done], jobs[done + 1:]
+        try:
+            raise CrashError('Unexpected exit status %d' % status)
+        except CrashError:
+            self._handle_job_exception(crashed)
+
+        # within MULTI, so the rest is either in the batch or in the queue
+        pipe = self.resq.redis.pipeline()
+        for job in reversed(rest):
+            pipe.lpush(QUEUE_PREFIX + job._queue, ResQ.encode(job._payload))
+        pipe.delete('resque:worker:%s' % self, self.batch_key(),
+                self.batch_queue_key())
+        pipe.execute()
+        logger.warning('batch child crashed after %d of %d jobs, '
+                '%d jobs requeued', done, len(jobs), len(rest))
+
+    def record_samples(self, samples):
+        # metrics are off unless MetricsMixin is mixed in
+        pass
+
+class WorkerSlot(BlockingWorker):
+    '''
+    A single thread of a ThreadedWorker.
+
+    Every slot is registered as a separate worker with the
+    "host-slot:pid:queues" id, so the Working page shows what each
+    of them is doing. pyres prunes dead workers of its own host only,
+    so the suffix keeps other workers of the host from unregistering
+    busy slots; dead slots are left to the reaper, as they send
+    heartbeats like every worker started by pyres_worker.
+
+    Jobs run in the thread itself, which can not be killed: the worker
+    timeout does not apply, and a hung job holds its slot.
+    '''
+
+    def __init__(self, parent, index):
+        super(WorkerSlot, self).__init__(queues=parent.queues,
+                server=parent.resq)
+        self.parent = parent
+        self.id = '%s-%d:%s:%s' % (self.hostname, index, self.pid,
+                ','.join(self.queues))
+
+    def __str__(self):
+        return self.id
+
+    def work(self, interval=5):
+        self.register_worker()
+        try:
+            while not self.parent._shutdown:
+                job = self.reserve(interval)
+                if job:
+                    try:
+                        self.process(job)
+                    finally:
+                        close_db_connections()
+        finally:
+            self.unregister_worker()
+
+class ThreadedWorker(Worker):
+    '''
+    Worker running up to `threads` jobs at once within a single process,
+    for I/O-bound jobs. Jobs are not forked; every thread uses its own
+    django database connection, which is closed after each job.
+    '''
+
+    threads = 4
+    slot_class = WorkerSlot
+
+    def work(self, interval=5):
+        logger.info('starting %d threads', self.threads)
+        self.register_signal_handlers()
+        threads = [threading.Thread(target=self.slot_class(self, i).work,
+            args=(interval,)) for i in range(self.threads)]
+        for t in threads:
+            t.daemon = True
+            t.start()
+        # join with a timeout, so that signals still get delivered
+        while any(t.is_alive() for t in threads):
+            for t in threads:
+                t.join(1)
+        logger.info('all threads stopped')
+
+    def kill_child(self, signum, frame):
+        # there are no children to kill, running jobs are waited for
+        pass